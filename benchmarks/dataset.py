@@ -0,0 +1,120 @@
+import random
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import insert
+
+from sql import models, rollup
+from sql.database import Base, async_session, engine
+
+# Dataset shapes, 'full' matches production: every item with 30 days of minute ticks and 5m buckets
+SIZES = {
+    'small': {'items': 200, 'latest_days': 1, 'average_days': 7, 'daily_days': 30, 'recipes': 20},
+    'medium': {'items': 1000, 'latest_days': 3, 'average_days': 30, 'daily_days': 365, 'recipes': 100},
+    'full': {'items': 4000, 'latest_days': 30, 'average_days': 30, 'daily_days': 365, 'recipes': 400},
+}
+
+# Rows sent per executemany while generating
+INSERT_BATCH_SIZE = 20_000
+
+CATEGORIES = ('Runes', 'Ores', 'Bars', 'Logs', 'Herbs', 'Potions', 'Ammunition', 'Food', 'Armour', 'Weapons')
+
+
+async def reset_tables():
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+
+
+class PriceWalk:
+    """Reproducible random walk of low/high prices and volumes per item."""
+
+    def __init__(self, rng: random.Random, item_ids: list[int]):
+        self.rng = rng
+        self.mid = {item_id: rng.choice((5, 50, 500, 5_000, 50_000, 500_000, 5_000_000)) * rng.uniform(0.5, 2)
+                    for item_id in item_ids}
+
+    def step(self, item_id: int) -> tuple[int, int]:
+        mid = self.mid[item_id] = max(1.0, self.mid[item_id] * self.rng.gauss(1, 0.002))
+        spread = mid * self.rng.uniform(0.001, 0.03)
+        return max(1, int(mid - spread / 2)), max(1, int(mid + spread / 2))
+
+    def volume(self, item_id: int) -> int:
+        return int(self.rng.expovariate(1 / max(1.0, 2_000_000 / self.mid[item_id])))
+
+
+async def _insert_series(model, rows_at, stamps: list) -> int:
+    # Tables were just recreated, so plain executemany inserts replace the conflict handling of bulk_upsert
+    total, batch = 0, []
+    async with async_session() as session:
+        for stamp in stamps:
+            batch += rows_at(stamp)
+            if len(batch) >= INSERT_BATCH_SIZE or stamp is stamps[-1]:
+                await session.execute(insert(model), batch)
+                await session.commit()
+                total += len(batch)
+                batch = []
+    return total
+
+
+async def generate(size: str, seed: int = 0, now: datetime | None = None) -> dict[str, int]:
+    shape = SIZES[size]
+    rng = random.Random(seed)
+    now = (now or datetime.utcnow()).replace(minute=0, second=0, microsecond=0)
+    item_ids = list(range(1, shape['items'] + 1))
+    walk = PriceWalk(rng, item_ids)
+    counts = {}
+
+    await reset_tables()
+
+    async with async_session() as session:
+        items = [{'id': item_id, 'name': f'Item {item_id}', 'market': rng.randint(1, 10_000_000),
+                  'limit': rng.choice((40, 70, 100, 125, 500, 1_000, 5_000, 10_000, 25_000)),
+                  'members': rng.random() < 0.7, 'high_alch': rng.randint(1, 100_000),
+                  'low_alch': rng.randint(1, 60_000)} for item_id in item_ids]
+        await session.execute(insert(models.Items), items)
+        categories = [{'item_id': item_id, 'name': rng.choice(CATEGORIES)} for item_id in item_ids]
+        await session.execute(insert(models.Category), categories)
+        await session.commit()
+    counts['items'] = len(item_ids)
+
+    def latest_at(stamp):
+        return [{'item_id': item_id, 'low_price': low, 'high_price': high, 'time_stamp': stamp}
+                for item_id in item_ids for low, high in (walk.step(item_id),)]
+
+    minutes = shape['latest_days'] * 1440
+    stamps = [now - timedelta(minutes=minute) for minute in range(minutes, 0, -1)]
+    counts['latest'] = await _insert_series(models.Latest, latest_at, stamps)
+
+    def average_at(stamp):
+        return [{'item_id': item_id, 'low_price': low, 'high_price': high, 'low_volume': walk.volume(item_id),
+                 'high_volume': walk.volume(item_id), 'time_stamp': stamp}
+                for item_id in item_ids for low, high in (walk.step(item_id),)]
+
+    buckets = shape['average_days'] * 288
+    stamps = [now - timedelta(minutes=5 * bucket) for bucket in range(buckets, 0, -1)]
+    counts['average'] = await _insert_series(models.Average, average_at, stamps)
+
+    def daily_at(stamp):
+        return [{'item_id': item_id, 'price': sum(walk.step(item_id)) // 2, 'volume': walk.volume(item_id) * 288,
+                 'date_stamp': stamp} for item_id in item_ids]
+
+    stamps = [date.today() - timedelta(days=day) for day in range(shape['daily_days'], 0, -1)]
+    counts['daily'] = await _insert_series(models.Daily, daily_at, stamps)
+
+    async with async_session() as session:
+        for recipe in range(shape['recipes']):
+            production = models.Production(item_id=rng.choice(item_ids), ticks=rng.choice((1, 2, 3, 4, 5, 9)),
+                                           facilities=rng.choice(('Furnace', 'Anvil', 'Bank')), members='T',
+                                           cost=rng.choice((0, 0, 0, 100)), quantity=rng.choice((1, 1, 1, 4, 15)))
+            production.materials = [models.Material(name=f'Item {material}', quantity=rng.randint(1, 5))
+                                    for material in rng.sample(item_ids, rng.randint(1, 3))]
+            production.skills = [models.Skill(experience=rng.uniform(1, 300), level=rng.randint(1, 99),
+                                              name=rng.choice(('Smithing', 'Crafting', 'Herblore')), boostable=True)]
+            session.add(production)
+        await session.commit()
+        counts['recipes'] = shape['recipes']
+
+        written = await rollup.rollup(session, now=now)
+        counts['candles'] = sum(written.values())
+
+    return counts
@@ -0,0 +1,239 @@
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import sys
+import time
+
+import httpx
+
+from benchmarks.dataset import SIZES, generate
+from main import app
+
+# Pool gauges and counters scraped from /metrics while the scenario runs
+POOL_GAUGES = ('flipper_pool_size', 'flipper_pool_checked_out', 'flipper_pool_overflow')
+POOL_COUNTERS = ('flipper_pool_wait_seconds_total', 'flipper_pool_checkouts_total')
+SAMPLE_PERIOD = 1.0
+
+
+class Bodies:
+    """Request bodies for the write routes, time stamps only move forward so writes never collide."""
+
+    def __init__(self, item_ids: list[int]):
+        self.item_ids = item_ids
+        # Creates round time stamps down to the minute
+        self.stamps = itertools.count(int(time.time()) // 60 * 60 + 86_400, 60)
+        self.new_items = itertools.count(max(item_ids, default=0) + 1_000_000)
+
+    def latest(self, rng: random.Random) -> dict:
+        low = rng.randint(1, 1_000_000)
+        return {'item_id': rng.choice(self.item_ids), 'low_price': low, 'high_price': low + rng.randint(0, 1000),
+                'time_stamp': next(self.stamps)}
+
+    def average(self, rng: random.Random) -> dict:
+        return {**self.latest(rng), 'low_volume': rng.randint(0, 10_000), 'high_volume': rng.randint(0, 10_000)}
+
+    def latest_bulk(self, rng: random.Random) -> dict:
+        return {'time_stamp': next(self.stamps), 'data': [
+            {'item_id': item_id, 'low_price': low, 'high_price': low + rng.randint(0, 1000)}
+            for item_id in self.item_ids for low in (rng.randint(1, 1_000_000),)]}
+
+    def average_bulk(self, rng: random.Random) -> dict:
+        bulk = self.latest_bulk(rng)
+        for row in bulk['data']:
+            row.update(low_volume=rng.randint(0, 10_000), high_volume=rng.randint(0, 10_000))
+        return bulk
+
+    def item(self, rng: random.Random) -> dict:
+        item_id = next(self.new_items)
+        return {'id': item_id, 'name': f'Load {item_id}', 'market': 1, 'limit': 100, 'members': False,
+                'high_alch': 1, 'low_alch': 1}
+
+
+class RouteStats:
+    def __init__(self):
+        self.latencies: list[float] = []
+        self.errors: dict[str, int] = {}
+
+    def error(self, kind: str) -> None:
+        self.errors[kind] = self.errors.get(kind, 0) + 1
+
+
+def percentile(ordered: list[float], fraction: float) -> float | None:
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def parse_metrics(text: str) -> dict[str, float]:
+    # Sums every series of the pool metrics, labels are dropped
+    values = {}
+    for line in text.splitlines():
+        if line.startswith('#') or not line:
+            continue
+        name, _, value = line.rpartition(' ')
+        name = name.split('{', 1)[0]
+        if name in POOL_GAUGES or name in POOL_COUNTERS:
+            values[name] = values.get(name, 0.0) + float(value)
+    return values
+
+
+async def client_loop(client: httpx.AsyncClient, group: dict, bodies: Bodies, stats: dict[str, RouteStats],
+                      deadline: float, rng: random.Random) -> None:
+    requests = group['requests']
+    weights = [request.get('weight', 1) for request in requests]
+    think = group.get('think_ms', 0) / 1000
+
+    # Spread the first requests over one think time so clients do not start in lockstep
+    await asyncio.sleep(min(rng.uniform(0, think), max(0.0, deadline - time.monotonic())))
+    while time.monotonic() < deadline:
+        request = rng.choices(requests, weights)[0]
+        method = request.get('method', 'GET')
+        name = f"{method} {request['path']}"
+        url = request['path'].format(item_id=rng.choice(bodies.item_ids))
+        body = getattr(bodies, request['body'])(rng) if 'body' in request else None
+
+        route = stats.setdefault(name, RouteStats())
+        started = time.perf_counter()
+        try:
+            response = await client.request(method, url, json=body, params=request.get('params'))
+            await response.aread()
+        except httpx.HTTPError as e:
+            route.error(type(e).__name__)
+        else:
+            route.latencies.append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                route.error(str(response.status_code))
+
+        if think:
+            await asyncio.sleep(min(rng.expovariate(1 / think), max(0.0, deadline - time.monotonic())))
+
+
+async def sample_pool(client: httpx.AsyncClient, samples: list[dict], deadline: float) -> None:
+    while time.monotonic() < deadline:
+        try:
+            response = await client.get('/metrics')
+            samples.append(parse_metrics(response.text))
+        except httpx.HTTPError:
+            pass
+        await asyncio.sleep(min(SAMPLE_PERIOD, max(0.0, deadline - time.monotonic())))
+
+
+def report(scenario: dict, stats: dict[str, RouteStats], samples: list[dict], elapsed: float) -> dict:
+    routes = {}
+    for name, route in sorted(stats.items()):
+        ordered = sorted(seconds * 1000 for seconds in route.latencies)
+        errors = sum(route.errors.values())
+        total = len(route.latencies) + sum(count for kind, count in route.errors.items() if not kind.isdigit())
+        routes[name] = {'requests': total, 'throughput': total / elapsed, 'errors': route.errors,
+                        'error_rate': errors / total if total else 0.0, 'p50_ms': percentile(ordered, 0.50),
+                        'p95_ms': percentile(ordered, 0.95), 'p99_ms': percentile(ordered, 0.99),
+                        'max_ms': ordered[-1] if ordered else None}
+
+    everything = sorted(seconds * 1000 for route in stats.values() for seconds in route.latencies)
+    requests = sum(route['requests'] for route in routes.values())
+    errors = sum(sum(route['errors'].values()) for route in routes.values())
+
+    # QueuePool only, NullPool (the SQLite default) exposes no gauges and never saturates
+    pool = {}
+    if samples:
+        pool = {f'max_{name}': max(sample.get(name, 0.0) for sample in samples) for name in POOL_GAUGES
+                if any(name in sample for sample in samples)}
+        for name in POOL_COUNTERS:
+            pool[name.removesuffix('_total')] = samples[-1].get(name, 0.0) - samples[0].get(name, 0.0)
+
+    return {'scenario': scenario.get('name'), 'seconds': elapsed, 'requests': requests,
+            'throughput': requests / elapsed, 'errors': errors, 'error_rate': errors / requests if requests else 0.0,
+            'p50_ms': percentile(everything, 0.50), 'p95_ms': percentile(everything, 0.95),
+            'p99_ms': percentile(everything, 0.99), 'pool': pool, 'routes': routes}
+
+
+async def run(scenario: dict, client: httpx.AsyncClient, seed: int) -> dict:
+    response = await client.get('/items/', params={'limit': 1_000_000})
+    response.raise_for_status()
+    bodies = Bodies([item['id'] for item in response.json()])
+    if not bodies.item_ids:
+        raise SystemExit('No items in the database, run with --generate or load data first')
+
+    rng = random.Random(seed)
+    stats: dict[str, RouteStats] = {}
+    samples: list[dict] = []
+    started = time.monotonic()
+    deadline = started + scenario['duration']
+
+    tasks = [sample_pool(client, samples, deadline)]
+    for group in scenario['groups']:
+        for _ in range(group.get('clients', 1)):
+            tasks.append(client_loop(client, group, bodies, stats, deadline, random.Random(rng.random())))
+    await asyncio.gather(*tasks)
+
+    # One last sample so the counter deltas cover the whole run
+    samples.append(parse_metrics((await client.get('/metrics')).text))
+    return report(scenario, stats, samples, time.monotonic() - started)
+
+
+def print_summary(result: dict) -> None:
+    def ms(value):
+        return f'{value:9.2f}' if value is not None else f"{'-':>9}"
+
+    print(f"{result['scenario']}: {result['requests']} requests in {result['seconds']:.1f}s, "
+          f"{result['throughput']:.1f} req/s, {result['error_rate']:.2%} errors, p50 {ms(result['p50_ms']).strip()} "
+          f"p95 {ms(result['p95_ms']).strip()} p99 {ms(result['p99_ms']).strip()} ms", file=sys.stderr)
+    for name, route in result['routes'].items():
+        print(f"  {name:40} {route['requests']:8} {route['throughput']:9.1f}/s {ms(route['p50_ms'])} "
+              f"{ms(route['p95_ms'])} {ms(route['p99_ms'])} {route['error_rate']:7.2%}", file=sys.stderr)
+    if result['pool']:
+        print(f"  pool: {result['pool']}", file=sys.stderr)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description='Drive the API with concurrent clients following a scenario file')
+    parser.add_argument('scenario', help='JSON scenario, see benchmarks/scenarios/')
+    parser.add_argument('--url', help='base URL of a running server (default: call main.app in-process)')
+    parser.add_argument('--duration', type=float, help="override the scenario's duration in seconds")
+    parser.add_argument('--generate', help=f"build a dataset of this size first, one of {', '.join(SIZES)}")
+    parser.add_argument('--reset', action='store_true',
+                        help='confirm that --generate may drop and recreate all tables of DB_URL')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    args = parser.parse_args()
+
+    if args.generate is not None and (args.generate not in SIZES or not args.reset):
+        parser.error(f"--generate takes one of {', '.join(SIZES)} and requires --reset")
+
+    with open(args.scenario) as f:
+        scenario = json.load(f)
+    if args.duration is not None:
+        scenario['duration'] = args.duration
+
+    if args.generate is not None:
+        print(f'generated {await generate(args.generate, seed=args.seed)}', file=sys.stderr)
+
+    clients = sum(group.get('clients', 1) for group in scenario['groups'])
+    limits = httpx.Limits(max_connections=clients + 1, max_keepalive_connections=clients + 1)
+    timeout = httpx.Timeout(scenario.get('timeout', 30.0))
+    if args.url is not None:
+        async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=timeout) as client:
+            result = await run(scenario, client, args.seed)
+    else:
+        await app.router.startup()
+        try:
+            # Unhandled exceptions become 500 responses and are counted, as they would be behind a server
+            transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+            async with httpx.AsyncClient(transport=transport, base_url='http://load', timeout=timeout) as client:
+                result = await run(scenario, client, args.seed)
+        finally:
+            await app.router.shutdown()
+
+    print_summary(result)
+    text = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,328 @@
+import argparse
+import asyncio
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+
+import httpx
+import sqlalchemy
+from sqlalchemy import func, select
+
+from benchmarks.dataset import SIZES, generate
+from main import app
+from sql import crud, export, models, schemas
+from sql.cache import latest_cache
+from sql.database import async_session, engine
+from sql.flips import flip_scanner
+from sql.indicators import indicator_engine
+from sql.recipes import recipe_engine
+
+# Median slowdown over the baseline tolerated before a case counts as a regression, sub-millisecond cases are mostly
+# timer noise so the slowdown must also exceed MIN_REGRESSION_MS
+TOLERANCE = 0.25
+MIN_REGRESSION_MS = 0.5
+
+
+class Fixtures:
+    """Ids of existing rows the cases read, found once per dataset."""
+
+    async def load(self, session) -> None:
+        self.now = datetime.utcnow()
+        self.item_id = (await session.execute(select(func.max(models.Items.id)))).scalar() // 2
+        self.item_name = f'Item {self.item_id}'
+        self.production_id = (await session.execute(select(func.min(models.Production.id)))).scalar()
+        self.category_id = (await session.execute(select(func.min(models.Category.id)))).scalar()
+        self.skill_id = (await session.execute(select(func.min(models.Skill.id)))).scalar()
+        self.material_id = (await session.execute(select(func.min(models.Material.id)))).scalar()
+        self.latest_id = (await session.execute(select(func.max(models.Latest.id)))).scalar()
+        self.average_id = (await session.execute(select(func.max(models.Average.id)))).scalar()
+        self.daily_id = (await session.execute(select(func.max(models.Daily.id)))).scalar()
+        self.next_item_id = self.item_id * 2 + 1
+        self.step = 0
+
+    def stamp(self) -> float:
+        # Distinct timestamps in the future so writes never collide with the dataset or each other
+        self.step += 1
+        return (self.now + timedelta(days=1, minutes=self.step)).timestamp()
+
+    def new_item(self) -> schemas.ItemCreate:
+        self.next_item_id += 1
+        return schemas.ItemCreate(id=self.next_item_id, name=f'Item {self.next_item_id}', market=1, limit=100,
+                                  members=False, high_alch=1, low_alch=1)
+
+
+def _latest(fx):
+    return schemas.LatestCreate(item_id=fx.item_id, low_price=100, high_price=110, time_stamp=fx.stamp())
+
+
+def _average(fx):
+    return schemas.AverageCreate(item_id=fx.item_id, low_price=100, high_price=110, low_volume=5, high_volume=5,
+                                 time_stamp=fx.stamp())
+
+
+def _daily(fx):
+    fx.stamp()
+    return schemas.DailyCreate(item_id=fx.item_id, price=105, volume=10,
+                               date_stamp=fx.now.date() + timedelta(days=fx.step))
+
+
+async def _created(session, create, value):
+    return (await create(session, value)).id
+
+
+# name: (prepare, call), prepare runs untimed in the same session and its result is passed to call
+CRUD_CASES = {
+    'get_item': (None, lambda db, fx, _: crud.get_item(db, fx.item_id)),
+    'get_items': (None, lambda db, fx, _: crud.get_items(db)),
+    'get_items_full': (None, lambda db, fx, _: crud.get_items_full(db)),
+    'get_item_full': (None, lambda db, fx, _: crud.get_item_full(db, fx.item_id)),
+    'get_category': (None, lambda db, fx, _: crud.get_category(db, fx.category_id)),
+    'get_category_by_item': (None, lambda db, fx, _: crud.get_category_by_item(db, fx.item_id)),
+    'get_latest': (None, lambda db, fx, _: crud.get_latest(db, fx.latest_id)),
+    'get_latest_all': (None, lambda db, fx, _: crud.get_latest_all(db)),
+    'get_latest_all_unbounded': (None, lambda db, fx, _: crud.get_latest_all(db, limit=None)),
+    'get_latest_by_item': (None, lambda db, fx, _: crud.get_latest_by_item(db, fx.item_id, limit=100)),
+    'get_average': (None, lambda db, fx, _: crud.get_average(db, fx.average_id)),
+    'get_average_all': (None, lambda db, fx, _: crud.get_average_all(db)),
+    'get_average_by_item': (None, lambda db, fx, _: crud.get_average_by_item(db, fx.item_id, limit=100)),
+    'get_daily': (None, lambda db, fx, _: crud.get_daily(db, fx.daily_id)),
+    'get_daily_all': (None, lambda db, fx, _: crud.get_daily_all(db)),
+    'get_daily_by_item': (None, lambda db, fx, _: crud.get_daily_by_item(db, fx.item_id, limit=100)),
+    'get_candles_by_item': (None, lambda db, fx, _: crud.get_candles_by_item(db, fx.item_id, '5m', limit=100)),
+    'get_production': (None, lambda db, fx, _: crud.get_production(db, fx.production_id)),
+    'get_production_full': (None, lambda db, fx, _: crud.get_production_full(db, fx.production_id)),
+    'get_production_by_item': (None, lambda db, fx, _: crud.get_production_by_item(db, fx.item_id)),
+    'get_skill': (None, lambda db, fx, _: crud.get_skill(db, fx.skill_id)),
+    'get_skill_by_production': (None, lambda db, fx, _: crud.get_skill_by_production(db, fx.production_id)),
+    'get_material': (None, lambda db, fx, _: crud.get_material(db, fx.material_id)),
+    'get_material_by_production': (None, lambda db, fx, _: crud.get_material_by_production(db, fx.production_id)),
+    'create_item': (lambda db, fx: fx.new_item(), lambda db, fx, item: crud.create_item(db, item)),
+    'update_item': (None, lambda db, fx, _: crud.update_item(db, schemas.ItemCreate(
+        id=fx.item_id, name=fx.item_name, market=2, limit=100, members=True, high_alch=1, low_alch=1))),
+    'create_category': (None, lambda db, fx, _: crud.create_category(db, schemas.CategoryCreate(
+        name='Benchmark', item_id=fx.item_id))),
+    'create_latest': (lambda db, fx: _latest(fx), lambda db, fx, latest: crud.create_latest(db, latest)),
+    'create_latest_bulk': (lambda db, fx: schemas.LatestBulkCreate(time_stamp=fx.stamp(), data=[
+        schemas.LatestBase(item_id=item_id, low_price=100, high_price=110) for item_id in range(1, fx.item_id * 2)]),
+        lambda db, fx, bulk: crud.create_latest_bulk(db, bulk)),
+    'create_average': (lambda db, fx: _average(fx), lambda db, fx, average: crud.create_average(db, average)),
+    'create_average_bulk': (lambda db, fx: schemas.AverageBulkCreate(time_stamp=fx.stamp(), data=[
+        schemas.AverageBase(item_id=item_id, low_price=100, high_price=110, low_volume=5, high_volume=5)
+        for item_id in range(1, fx.item_id * 2)]), lambda db, fx, bulk: crud.create_average_bulk(db, bulk)),
+    'create_daily': (lambda db, fx: _daily(fx), lambda db, fx, daily: crud.create_daily(db, daily)),
+    'create_skill': (None, lambda db, fx, _: crud.create_skill(db, schemas.SkillCreate(
+        production_id=fx.production_id, experience=1.0, level=1, name='Benchmark', boostable=False))),
+    'create_material': (None, lambda db, fx, _: crud.create_material(db, schemas.MaterialCreate(
+        production_id=fx.production_id, name=fx.item_name, quantity=1))),
+    'delete_category': (lambda db, fx: _created(db, crud.create_category, schemas.CategoryCreate(
+        name='Benchmark', item_id=fx.item_id)), lambda db, fx, cat_id: crud.delete_category(db, cat_id)),
+    'delete_latest': (lambda db, fx: _created(db, crud.create_latest, _latest(fx)),
+                      lambda db, fx, latest_id: crud.delete_latest(db, latest_id)),
+    'delete_average': (lambda db, fx: _created(db, crud.create_average, _average(fx)),
+                       lambda db, fx, average_id: crud.delete_average(db, average_id)),
+    'delete_daily': (lambda db, fx: _created(db, crud.create_daily, _daily(fx)),
+                     lambda db, fx, daily_id: crud.delete_daily(db, daily_id)),
+    'delete_item': (lambda db, fx: _created(db, crud.create_item, fx.new_item()),
+                    lambda db, fx, item_id: crud.delete_item(db, item_id)),
+}
+
+
+def _stamp_query(fx) -> str:
+    return f'start={(fx.now - timedelta(days=1)).isoformat()}'
+
+
+def _watchlist(fx: Fixtures) -> str:
+    return ','.join(str(item_id) for item_id in range(fx.item_id, fx.item_id + 50))
+
+
+# name: (method, url, json body), the name is the route template as reported by /metrics
+ROUTE_CASES = {
+    'GET /': lambda fx: ('GET', '/', None),
+    'GET /cache/': lambda fx: ('GET', '/cache/', None),
+    'GET /metrics': lambda fx: ('GET', '/metrics', None),
+    'GET /items/': lambda fx: ('GET', '/items/', None),
+    'GET /items/ (1000 rows)': lambda fx: ('GET', '/items/?limit=1000', None),
+    'GET /items/?ids= (50 ids)': lambda fx: ('GET', f'/items/?ids={_watchlist(fx)}', None),
+    'GET /items/{item_id}/': lambda fx: ('GET', f'/items/{fx.item_id}/', None),
+    'GET /items/search/': lambda fx: ('GET', f'/items/search/?q=item {fx.item_id // 10}', None),
+    'GET /items/full/': lambda fx: ('GET', '/items/full/', None),
+    'GET /items/full/{item_id}/': lambda fx: ('GET', f'/items/full/{fx.item_id}/', None),
+    'GET /latest/': lambda fx: ('GET', '/latest/', None),
+    'GET /latest/ (1000 rows)': lambda fx: ('GET', '/latest/?limit=1000', None),
+    'GET /latest/ (1000 rows, filtered)': lambda fx: ('GET', '/latest/?limit=1000&min_limit=0', None),
+    'GET /latest/current/ (50 ids)': lambda fx: ('GET', f'/latest/current/?ids={_watchlist(fx)}', None),
+    'GET /latest/{item_id}/': lambda fx: ('GET', f'/latest/{fx.item_id}/', None),
+    'GET /latest/{item_id}/current/': lambda fx: ('GET', f'/latest/{fx.item_id}/current/', None),
+    'GET /average/': lambda fx: ('GET', '/average/', None),
+    'GET /average/ (1000 rows)': lambda fx: ('GET', '/average/?limit=1000', None),
+    'GET /average/current/ (50 ids)': lambda fx: ('GET', f'/average/current/?ids={_watchlist(fx)}', None),
+    'GET /average/{item_id}/': lambda fx: ('GET', f'/average/{fx.item_id}/', None),
+    'GET /daily/': lambda fx: ('GET', '/daily/', None),
+    'GET /daily/{item_id}/': lambda fx: ('GET', f'/daily/{fx.item_id}/', None),
+    'GET /candles/{item_id}/': lambda fx: ('GET', f'/candles/{fx.item_id}/?interval=1h', None),
+    'GET /indicators/{item_id}/': lambda fx: ('GET', f'/indicators/{fx.item_id}/', None),
+    'GET /flips/': lambda fx: ('GET', '/flips/', None),
+    'GET /production/profit/': lambda fx: ('GET', '/production/profit/', None),
+    'GET /export/{table}/': lambda fx: ('GET', f'/export/latest/?item_id={fx.item_id}&{_stamp_query(fx)}', None),
+    'POST /items/': lambda fx: ('POST', '/items/', fx.new_item().dict()),
+    'POST /latest/': lambda fx: ('POST', '/latest/', _latest(fx).dict()),
+    'POST /latest/bulk/': lambda fx: ('POST', '/latest/bulk/', {'time_stamp': fx.stamp(), 'data': [
+        {'item_id': item_id, 'low_price': 100, 'high_price': 110} for item_id in range(1, fx.item_id * 2)]}),
+    'POST /average/': lambda fx: ('POST', '/average/', _average(fx).dict()),
+    'POST /average/bulk/': lambda fx: ('POST', '/average/bulk/', {'time_stamp': fx.stamp(), 'data': [
+        {'item_id': item_id, 'low_price': 100, 'high_price': 110, 'low_volume': 5, 'high_volume': 5}
+        for item_id in range(1, fx.item_id * 2)]}),
+    'POST /daily/': lambda fx: ('POST', '/daily/', json.loads(_daily(fx).json())),
+}
+
+
+def summarize(timings: list[float]) -> dict[str, float]:
+    timings = sorted(seconds * 1000 for seconds in timings)
+    return {'runs': len(timings), 'min_ms': timings[0], 'median_ms': statistics.median(timings),
+            'p95_ms': timings[min(len(timings) - 1, int(len(timings) * 0.95))], 'mean_ms': statistics.fmean(timings)}
+
+
+async def time_crud(fx: Fixtures, name: str, repeat: int, warmup: int) -> dict[str, float]:
+    prepare, call = CRUD_CASES[name]
+    timings = []
+    for run in range(warmup + repeat):
+        # A fresh session per run so identity map hits never stand in for queries
+        async with async_session() as session:
+            argument = prepare(session, fx) if prepare is not None else None
+            if asyncio.iscoroutine(argument):
+                argument = await argument
+            started = time.perf_counter()
+            await call(session, fx, argument)
+            elapsed = time.perf_counter() - started
+        if run >= warmup:
+            timings.append(elapsed)
+    return summarize(timings)
+
+
+async def time_route(client: httpx.AsyncClient, fx: Fixtures, name: str, repeat: int,
+                     warmup: int) -> dict[str, float]:
+    timings = []
+    for run in range(warmup + repeat):
+        method, url, body = ROUTE_CASES[name](fx)
+        started = time.perf_counter()
+        response = await client.request(method, url, json=body)
+        await response.aread()
+        elapsed = time.perf_counter() - started
+        if response.status_code >= 400:
+            raise RuntimeError(f'{name}: {method} {url} returned {response.status_code} {response.text[:200]}')
+        if run >= warmup:
+            timings.append(elapsed)
+    return summarize(timings)
+
+
+def _reset_caches() -> None:
+    latest_cache.invalidate()
+    flip_scanner.loaded = 0.0
+    recipe_engine.loaded = 0.0
+    indicator_engine.items.clear()
+
+
+async def run_size(size: str, seed: int, repeat: int, warmup: int, only: str | None) -> dict:
+    started = time.perf_counter()
+    counts = await generate(size, seed=seed)
+    generated = time.perf_counter() - started
+    print(f'{size}: generated {counts} in {generated:.1f}s', file=sys.stderr)
+
+    _reset_caches()
+    await app.router.startup()
+
+    fx = Fixtures()
+    async with async_session() as session:
+        await fx.load(session)
+
+    results = {}
+    for name in CRUD_CASES:
+        key = f'crud.{name}'
+        if only is None or only in key:
+            results[key] = await time_crud(fx, name, repeat, warmup)
+            print(f"{size} {key}: {results[key]['median_ms']:.2f} ms", file=sys.stderr)
+
+    # Routes are called in-process, timings include routing, validation and serialization but no network
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://benchmark') as client:
+        for name in ROUTE_CASES:
+            if only is None or only in name:
+                _reset_caches()
+                results[name] = await time_route(client, fx, name, repeat, warmup)
+                print(f"{size} {name}: {results[name]['median_ms']:.2f} ms", file=sys.stderr)
+
+    await app.router.shutdown()
+    return {'rows': counts, 'generate_seconds': generated, 'results': results}
+
+
+def _commit() -> str | None:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(report: dict, baseline: dict, tolerance: float = TOLERANCE) -> list[str]:
+    regressions = []
+    for size, current in report['sizes'].items():
+        previous = baseline.get('sizes', {}).get(size, {}).get('results', {})
+        for name, stats in current['results'].items():
+            if name not in previous:
+                continue
+            before, after = previous[name]['median_ms'], stats['median_ms']
+            change = after / before - 1 if before else 0.0
+            flag = 'REGRESSION' if change > tolerance and after - before > MIN_REGRESSION_MS else ''
+            print(f'{size:8} {name:40} {before:10.2f} {after:10.2f} {change:+8.1%} {flag}', file=sys.stderr)
+            if flag:
+                regressions.append(f'{size} {name}')
+    return regressions
+
+
+async def main():
+    parser = argparse.ArgumentParser(description='Benchmark every crud function and route on a synthetic dataset')
+    parser.add_argument('--reset', action='store_true', required=True,
+                        help='confirm that all tables of DB_URL may be dropped and recreated')
+    parser.add_argument('--sizes', nargs='*', default=['small'], help=f"any of {', '.join(SIZES)} (default small)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=20, help='timed runs per case')
+    parser.add_argument('--warmup', type=int, default=2, help='untimed runs per case')
+    parser.add_argument('--only', help='only run cases whose name contains this')
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    parser.add_argument('--baseline', help='JSON report to compare medians against')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE)
+    args = parser.parse_args()
+
+    unknown = set(args.sizes) - set(SIZES)
+    if unknown:
+        parser.error(f"unknown sizes: {', '.join(sorted(unknown))}")
+
+    report = {
+        'meta': {'created': datetime.utcnow().isoformat(), 'commit': _commit(), 'dialect': engine.dialect.name,
+                 'python': platform.python_version(), 'sqlalchemy': sqlalchemy.__version__,
+                 'platform': platform.platform(), 'seed': args.seed, 'repeat': args.repeat, 'warmup': args.warmup,
+                 'export_batch_size': export.EXPORT_BATCH_SIZE},
+        'sizes': {size: await run_size(size, args.seed, args.repeat, args.warmup, args.only) for size in args.sizes},
+    }
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} regressions: {', '.join(regressions)}", file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -1,9 +1,156 @@
-from fastapi import Depends, FastAPI, HTTPException
-
-from sql import crud, models, schemas
+import asyncio
+from datetime import date, datetime
+from email.utils import format_datetime, parsedate_to_datetime
+from functools import partial
+from typing import Literal
+
+import orjson
+from fastapi import Depends, FastAPI, HTTPException, Query, Request, Response
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+
+from sql import crud, daily, export, flips, metrics, models, recipes, rollup, schemas, stream, writebehind
+from sql.alerts import alert_engine
+from sql.cache import latest_cache
+from sql.flips import flip_scanner
+from sql.indicators import indicator_engine
+from sql.recipes import recipe_engine
+from sql.search import item_index
+from sql.stream import broker
+from sql.versions import data_versions
+from sql.writebehind import average_writer, latest_writer
 from sql.database import async_session, engine
 
 app = FastAPI()
+app.add_middleware(metrics.MetricsMiddleware)
+metrics.instrument_engine(engine)
+
+
+@app.on_event('startup')
+async def load_caches():
+    await latest_cache.refresh()
+    await item_index.refresh()
+    await alert_engine.refresh()
+    await data_versions.refresh()
+
+
+@app.on_event('startup')
+async def start_rollups():
+    if rollup.ROLLUP_PERIOD > 0:
+        app.state.rollup_task = asyncio.create_task(rollup.run_periodically())
+
+
+@app.on_event('shutdown')
+async def stop_writers():
+    await latest_writer.stop()
+    await average_writer.stop()
+
+
+async def _published(table: str, rows: list, time_stamp: datetime | None = None) -> None:
+    # Every consumer of committed price rows, shared by the single, bulk and write-behind paths. Takes ORM rows, or
+    # bulk payload rows sharing one time stamp, and hands the consumers one PriceRow per row
+    if table == 'latest' and time_stamp is None:
+        for row in rows:
+            latest_cache.put(row)
+    elif table == 'latest':
+        # Payload rows carry no ids, the cache reloads them
+        latest_cache.invalidate()
+
+    prices = [schemas.PriceRow(row.item_id, time_stamp or row.time_stamp, row.low_price, row.high_price,
+                               getattr(row, 'low_volume', None), getattr(row, 'high_volume', None)) for row in rows]
+    if table == 'average':
+        indicator_engine.ingest(prices)
+    broker.publish(table, prices)
+    await alert_engine.ingest(table, prices)
+
+
+def _changed_elsewhere(table: str) -> None:
+    # Another worker or job wrote the table, the cached prices would otherwise lag the validators that cover them
+    if table == 'latest':
+        latest_cache.invalidate()
+
+
+data_versions.on_change.append(_changed_elsewhere)
+latest_writer.on_flush.append(partial(_published, 'latest'))
+average_writer.on_flush.append(partial(_published, 'average'))
+
+
+async def _write_behind(writer: writebehind.WriteBehind, create) -> models.Latest | models.Average | JSONResponse:
+    row = {**create.dict(), 'time_stamp': await crud.round_to_nearest(create.time_stamp, 1)}
+    committed = await writer.put(row)
+    if writer.mode == 'enqueue':
+        return JSONResponse(status_code=202, content={'status': 'queued', 'item_id': row['item_id'],
+                                                      'time_stamp': row['time_stamp'].isoformat()})
+    return committed
+
+
+def _filtered(filters: schemas.ItemFilter) -> bool:
+    return any(value is not None for value in filters.dict().values())
+
+
+def _cursor(cursor: str | None, stamp_type: type = datetime) -> datetime | date | None:
+    try:
+        return crud.decode_cursor(cursor, stamp_type) if cursor is not None else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail='Invalid cursor')
+
+
+def _page(rows: list, key: str, limit: int) -> dict:
+    # A short page is the last one, otherwise resume strictly before the oldest row returned
+    next_cursor = crud.encode_cursor(getattr(rows[-1], key)) if len(rows) == limit else None
+    return {'data': rows, 'next_cursor': next_cursor}
+
+
+def _ids(ids: str, limit: int) -> list[int]:
+    # Comma separated item ids, deduplicated and sorted
+    try:
+        item_ids = sorted({int(item_id) for item_id in ids.split(',') if item_id.strip()})
+    except ValueError:
+        raise HTTPException(status_code=400, detail='Invalid item ids')
+    if not item_ids or len(item_ids) > limit:
+        raise HTTPException(status_code=400, detail=f'Between 1 and {limit} item ids are accepted')
+    return item_ids
+
+
+def _json(response: Response, body: bytes) -> Response:
+    # Bodies already encoded bypass response_model, headers set on the injected response are carried over
+    return Response(body, media_type='application/json', headers=dict(response.headers))
+
+
+def _json_rows(response: Response, fields: tuple[str, ...], rows: list) -> Response:
+    # Plain rows encoded straight to the document response_model would produce, without a model per row
+    return _json(response, orjson.dumps([dict(zip(fields, row)) for row in rows]))
+
+
+def _json_map(response: Response, fields: tuple[str, ...], key: str, rows: list) -> Response:
+    # Multi-get bodies, the rows keyed by their item id
+    rows = [dict(zip(fields, row)) for row in rows]
+    return _json(response, orjson.dumps({row[key]: row for row in rows}, option=orjson.OPT_NON_STR_KEYS))
+
+
+async def _not_modified(request: Request, response: Response, *tables: str) -> Response | None:
+    # Validators come from the shared write sequences, read at most once per DATA_VERSION_TTL, a 304 costs no
+    # serialization and usually no query
+    await data_versions.refresh()
+    etag = data_versions.etag(*tables)
+    last_modified = data_versions.last_modified(*tables)
+    headers = {'ETag': etag, 'Last-Modified': format_datetime(last_modified, usegmt=True)}
+
+    if_none_match = request.headers.get('if-none-match')
+    if_modified_since = request.headers.get('if-modified-since')
+    if if_none_match is not None:
+        fresh = if_none_match.strip() == '*' or etag in (tag.strip() for tag in if_none_match.split(','))
+    elif if_modified_since is not None:
+        try:
+            fresh = parsedate_to_datetime(if_modified_since) >= last_modified
+        except (TypeError, ValueError):
+            fresh = False
+    else:
+        fresh = False
+
+    if fresh:
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
 
 
 @app.get('/')
@@ -11,46 +158,155 @@ async def root():
     return {"message": "Hello World"}
 
 
+@app.get('/cache/')
+async def read_cache_stats():
+    return {'latest': latest_cache.stats()}
+
+
+@app.get('/metrics', response_class=PlainTextResponse)
+async def read_metrics():
+    counters = {f'flipper_latest_cache_{name}_total': getattr(latest_cache, name)
+                for name in ('hits', 'misses', 'refreshes')}
+    gauges = metrics.pool_gauges(engine)
+    counters.update({f'flipper_alerts_{name}_total': value for name, value in alert_engine.stats().items()
+                     if name in ('evaluated', 'triggered')})
+    gauges['flipper_alert_rules'] = len(alert_engine.rules)
+    counters.update({f'flipper_indicators_{name}_total': value for name, value in indicator_engine.stats().items()
+                     if name != 'items'})
+    gauges['flipper_indicator_items'] = len(indicator_engine.items)
+    stream_stats = broker.stats()
+    counters.update({f'flipper_stream_{name}_total': stream_stats[name]
+                     for name in ('published', 'delivered', 'dropped')})
+    gauges.update({'flipper_stream_connections': stream_stats['connections'],
+                   'flipper_stream_items': stream_stats['items']})
+    for table, writer in (('latest', latest_writer), ('average', average_writer)):
+        stats = writer.stats()
+        counters.update({f'flipper_write_behind_{table}_{name}_total': stats[name]
+                         for name in ('received', 'written', 'batches', 'failed', 'flush_seconds', 'wait_seconds')})
+        gauges.update({f'flipper_write_behind_{table}_queued': stats['queued'],
+                       f'flipper_write_behind_{table}_max_batch': stats['max_batch']})
+    return PlainTextResponse(metrics.render(counters=counters, gauges=gauges),
+                             media_type='text/plain; version=0.0.4')
+
+
 @app.post('/latest/', response_model=schemas.Latest)
 async def create_latest(latest: schemas.LatestCreate):
+    if latest_writer.enabled:
+        return await _write_behind(latest_writer, latest)
+    async with async_session() as session:
+        db_latest = await crud.create_latest(session, latest=latest)
+    await _published('latest', [db_latest])
+    return db_latest
+
+
+@app.post('/latest/bulk/', response_model=schemas.BulkResult)
+async def create_latest_bulk(bulk: schemas.LatestBulkCreate):
     async with async_session() as session:
-        return await crud.create_latest(session, latest=latest)
+        result = await crud.create_latest_bulk(session, bulk=bulk)
+    await _published('latest', bulk.data, time_stamp=await crud.round_to_nearest(bulk.time_stamp, 1))
+    return result
 
 
 @app.get('/latest/', response_model=list[schemas.Latest])
-async def read_latest(limit: int = 100):
+async def read_latest(request: Request, response: Response, limit: int = 100,
+                      filters: schemas.ItemFilter = Depends()):
+    # Unfiltered listings stay on the price cache, filters are resolved by the database
+    filtered = _filtered(filters)
+    tables = ('latest', 'items', 'average') if filtered else ('latest',)
+    if (not_modified := await _not_modified(request, response, *tables)) is not None:
+        return not_modified
+    if not filtered:
+        return _json(response, await latest_cache.get_all_json(limit=limit))
     async with async_session() as session:
-        return await crud.get_latest_all(session, limit=limit)
+        rows = await crud.get_latest_all_rows(session, limit=limit, filters=filters)
+    return _json_rows(response, crud.LATEST_FIELDS, rows)
+
+
+@app.get('/latest/current/', response_model=dict[int, schemas.Latest])
+async def read_latest_current_many(request: Request, response: Response, ids: str):
+    item_ids = _ids(ids, crud.MULTI_GET_MAX_IDS)
+    if (not_modified := await _not_modified(request, response, 'latest')) is not None:
+        return not_modified
+    return _json(response, await latest_cache.get_many_json(item_ids))
 
 
-@app.get('/latest/{item_id}/', response_model=schemas.Latest)
-async def read_latest_by_item(item_id: int):
+@app.get('/latest/{item_id}/', response_model=schemas.Page[schemas.Latest])
+async def read_latest_by_item(item_id: int, start: datetime | None = None, end: datetime | None = None,
+                              limit: int = Query(100, ge=1, le=1000), cursor: str | None = None):
     async with async_session() as session:
-        return await crud.get_latest_by_item(session, item_id=item_id)
+        rows = await crud.get_latest_by_item(session, item_id=item_id, start=start, end=end, limit=limit,
+                                             before=_cursor(cursor))
+    return _page(rows, 'time_stamp', limit)
+
+
+@app.get('/latest/{item_id}/current/', response_model=schemas.Latest)
+async def read_latest_current(item_id: int):
+    latest = await latest_cache.get(item_id)
+    if latest is None:
+        raise HTTPException(status_code=404, detail='No prices for item')
+    return latest
 
 
 @app.post('/average/', response_model=schemas.Average)
 async def create_average(average: schemas.AverageCreate):
+    if average_writer.enabled:
+        return await _write_behind(average_writer, average)
     async with async_session() as session:
-        return await crud.create_average(session, average=average)
+        db_average = await crud.create_average(session, average=average)
+    await _published('average', [db_average])
+    return db_average
+
+
+@app.post('/average/bulk/', response_model=schemas.BulkResult)
+async def create_average_bulk(bulk: schemas.AverageBulkCreate, on_conflict: Literal['update', 'ignore'] = 'update'):
+    async with async_session() as session:
+        result = await crud.create_average_bulk(session, bulk=bulk, on_conflict=on_conflict)
+    await _published('average', bulk.data, time_stamp=await crud.round_to_nearest(bulk.time_stamp, 1))
+    return result
 
 
 @app.get('/average/', response_model=list[schemas.Average])
-async def read_average(limit: int = 100):
+async def read_average(response: Response, limit: int = 100):
+    async with async_session() as session:
+        rows = await crud.get_average_all_rows(session, limit=limit)
+    return _json_rows(response, crud.AVERAGE_FIELDS, rows)
+
+
+@app.get('/average/current/', response_model=dict[int, schemas.Average])
+async def read_average_current_many(request: Request, response: Response, ids: str):
+    item_ids = _ids(ids, crud.MULTI_GET_MAX_IDS)
+    if (not_modified := await _not_modified(request, response, 'average')) is not None:
+        return not_modified
     async with async_session() as session:
-        return await crud.get_average_all(session, limit=limit)
+        rows = await crud.get_average_current_rows(session, ids=item_ids)
+    return _json_map(response, crud.AVERAGE_FIELDS, 'item_id', rows)
 
 
-@app.get('/average/{item_id}/', response_model=schemas.Average)
-async def read_average_by_item(item_id: int):
+@app.get('/average/{item_id}/', response_model=schemas.Page[schemas.Average])
+async def read_average_by_item(item_id: int, start: datetime | None = None, end: datetime | None = None,
+                               limit: int = Query(100, ge=1, le=1000), cursor: str | None = None):
     async with async_session() as session:
-        return await crud.get_average_by_item(session, item_id=item_id)
+        rows = await crud.get_average_by_item(session, item_id=item_id, start=start, end=end, limit=limit,
+                                              before=_cursor(cursor))
+    return _page(rows, 'time_stamp', limit)
 
 
 @app.post('/daily/', response_model=schemas.Daily)
 async def create_daily(daily: schemas.DailyCreate):
     async with async_session() as session:
-        return await crud.create_daily(session, daily=daily)
+        db_daily = await crud.create_daily(session, daily=daily)
+    return db_daily
+
+
+@app.post('/daily/aggregate/', response_model=schemas.DailyAggregate)
+async def aggregate_daily(start: date | None = None, end: date | None = None):
+    # Without a start every day closed since the last run, with one a backfill of [start, end)
+    async with async_session() as session:
+        if start is not None:
+            result = await daily.backfill(session, start, end or datetime.utcnow().date())
+        else:
+            result = await daily.aggregate_pending(session, today=end)
+    return result
 
 
 @app.get('/daily/', response_model=list[schemas.Daily])
@@ -59,34 +315,175 @@ async def read_daily(limit: int = 100):
         return await crud.get_daily_all(session, limit=limit)
 
 
-@app.get('/daily/{item_id}/', response_model=schemas.Daily)
-async def read_daily_by_item(item_id: int):
+@app.get('/daily/{item_id}/', response_model=schemas.Page[schemas.Daily])
+async def read_daily_by_item(item_id: int, start: date | None = None, end: date | None = None,
+                             limit: int = Query(100, ge=1, le=1000), cursor: str | None = None):
+    async with async_session() as session:
+        rows = await crud.get_daily_by_item(session, item_id=item_id, start=start, end=end, limit=limit,
+                                            before=_cursor(cursor, date))
+    return _page(rows, 'date_stamp', limit)
+
+
+@app.get('/candles/{item_id}/', response_model=schemas.Page[schemas.Candle])
+async def read_candles_by_item(item_id: int, interval: Literal['5m', '1h', '1d'] = '5m', start: datetime | None = None,
+                               end: datetime | None = None, limit: int = Query(100, ge=1, le=1000),
+                               cursor: str | None = None):
     async with async_session() as session:
-        return await crud.get_daily_by_item(session, item_id=item_id)
+        rows = await crud.get_candles_by_item(session, item_id=item_id, interval=interval, start=start, end=end,
+                                              limit=limit, before=_cursor(cursor))
+    return _page(rows, 'time_stamp', limit)
+
+
+@app.get('/indicators/{item_id}/', response_model=schemas.Indicators)
+async def read_indicators(item_id: int):
+    indicators = await indicator_engine.get(item_id)
+    if indicators is None:
+        raise HTTPException(status_code=404, detail='No prices for item')
+    return indicators
+
+
+@app.get('/flips/', response_model=list[schemas.Flip])
+async def read_flips(limit: int = Query(100, ge=1, le=1000), members: bool | None = None, min_roi: float | None = None,
+                     min_volume: float | None = None, max_price: int | None = None, min_margin: int | None = None,
+                     sort: Literal[flips.SORT_KEYS] = 'profit'):
+    return await flip_scanner.scan(limit=limit, members=members, min_roi=min_roi, min_volume=min_volume,
+                                   max_price=max_price, min_margin=min_margin, sort=sort)
+
+
+@app.get('/production/profit/', response_model=list[schemas.RecipeProfit])
+async def read_production_profit(limit: int = Query(100, ge=1, le=1000),
+                                 sort: Literal[recipes.SORT_KEYS] = 'profit_per_hour'):
+    return await recipe_engine.rank(limit=limit, sort=sort)
+
+
+@app.post('/alerts/', response_model=schemas.AlertRule)
+async def create_alert_rule(rule: schemas.AlertRuleCreate):
+    async with async_session() as session:
+        if await crud.get_item(session, item_id=rule.item_id) is None:
+            raise HTTPException(status_code=404, detail='Item not found')
+        db_rule = await crud.create_alert_rule(session, rule=rule)
+    alert_engine.add(db_rule)
+    return db_rule
+
+
+@app.get('/alerts/{rule_id}/', response_model=schemas.AlertRule)
+async def read_alert_rule(rule_id: int):
+    async with async_session() as session:
+        db_rule = await crud.get_alert_rule(session, rule_id=rule_id)
+    if db_rule is None:
+        raise HTTPException(status_code=404, detail='Alert rule not found')
+    return db_rule
+
+
+@app.delete('/alerts/{rule_id}/', response_model=schemas.AlertRule)
+async def delete_alert_rule(rule_id: int):
+    async with async_session() as session:
+        db_rule = await crud.delete_alert_rule(session, rule_id=rule_id)
+    if db_rule is None:
+        raise HTTPException(status_code=404, detail='Alert rule not found')
+    alert_engine.remove(rule_id)
+    return db_rule
+
+
+@app.get('/alerts/{rule_id}/triggers/', response_model=schemas.Page[schemas.AlertTrigger])
+async def read_alert_triggers(rule_id: int, limit: int = Query(100, ge=1, le=1000), cursor: str | None = None):
+    async with async_session() as session:
+        rows = await crud.get_alert_triggers(session, rule_id=rule_id, limit=limit, before=_cursor(cursor))
+    return _page(rows, 'time_stamp', limit)
+
+
+@app.get('/stream/')
+async def stream_prices(items: str, sources: str = 'latest,average'):
+    # One long-lived event stream per client instead of polling /latest/{item_id}/, items is a comma separated id list
+    item_ids = set(_ids(items, stream.STREAM_MAX_ITEMS))
+    wanted = {source.strip() for source in sources.split(',') if source.strip()}
+    unknown = wanted - set(stream.SOURCES)
+    if not wanted or unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown sources: {', '.join(sorted(unknown))}")
+
+    subscriber = broker.subscribe(item_ids, wanted)
+    return StreamingResponse(broker.events(subscriber), media_type='text/event-stream',
+                             headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@app.get('/export/{table}/')
+async def export_table(table: Literal[tuple(export.EXPORT_TABLES)], format: Literal['ndjson', 'csv'] = 'ndjson',
+                       start: datetime | None = None, end: datetime | None = None, item_id: int | None = None):
+    rows = export.stream(table, format, start=start, end=end, item_id=item_id)
+    return StreamingResponse(rows, media_type=export.MEDIA_TYPES[format])
+
+
+def _include(include: str | None) -> set[str] | None:
+    if include is None:
+        return None
+
+    relations = {relation.strip() for relation in include.split(',') if relation.strip()}
+    unknown = relations - set(crud.FULL_RELATIONS)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown relations: {', '.join(sorted(unknown))}")
+    return relations
+
+
+def _item_full(item: models.Items, include: set[str] | None) -> dict:
+    # Relations that were not requested are left out entirely
+    full = {field: getattr(item, field) for field in crud.ITEM_FIELDS}
+    for relation, fields in crud.FULL_RELATION_FIELDS.items():
+        if include is None or relation in include:
+            full[relation] = [{field: getattr(row, field) for field in fields} for row in getattr(item, relation)]
+    return full
 
 
 @app.get('/items/full/', response_model=list[schemas.ItemFull])
-async def read_items_full(limit: int = 100):
+async def read_items_full(response: Response, limit: int = 100, include: str | None = None):
+    relations = _include(include)
     async with async_session() as session:
-        return await crud.get_items_full(session, limit=limit)
+        items = await crud.get_items_full(session, limit=limit, include=relations)
+    return _json(response, orjson.dumps([_item_full(item, relations) for item in items]))
 
 
 @app.get('/items/full/{item_id}/', response_model=schemas.ItemFull)
-async def read_item_full(item_id: int):
+async def read_item_full(request: Request, response: Response, item_id: int, include: str | None = None):
+    relations = _include(include)
+    tables = [model.__tablename__ for model, _, _ in crud.FULL_RELATIONS.values()]
+    if (not_modified := await _not_modified(request, response, 'items', *tables)) is not None:
+        return not_modified
+
     async with async_session() as session:
-        return await crud.get_item_full(session, item_id=item_id)
+        item = await crud.get_item_full(session, item_id=item_id, include=relations)
+    if item is None:
+        raise HTTPException(status_code=404, detail='Item not found')
+    return _json(response, orjson.dumps(_item_full(item, relations)))
 
 
 @app.post('/items/', response_model=schemas.Item)
 async def create_item(item: schemas.ItemCreate):
     async with async_session() as session:
-        return await crud.create_item(session, item=item)
-
-
-@app.get('/items/', response_model=list[schemas.Item])
-async def read_items(limit: int = 100):
+        db_item = await crud.create_item(session, item=item)
+    item_index.put(db_item)
+    return db_item
+
+
+# Declared before /items/{item_id}/ so "search" is not taken for an item id
+@app.get('/items/search/', response_model=list[schemas.ItemMatch])
+async def search_items(q: str = Query(..., min_length=1, max_length=100), limit: int = Query(20, ge=1, le=100),
+                       category: str | None = None, members: bool | None = None):
+    return await item_index.search(q, limit=limit, category=category, members=members)
+
+
+@app.get('/items/', response_model=list[schemas.Item] | dict[int, schemas.Item])
+async def read_items(request: Request, response: Response, limit: int = 100, ids: str | None = None,
+                     filters: schemas.ItemFilter = Depends()):
+    # With ids the requested items come back keyed by id, filters still apply and limit does not
+    item_ids = _ids(ids, crud.MULTI_GET_MAX_IDS) if ids is not None else None
+    tables = ('items', 'latest', 'average') if _filtered(filters) else ('items',)
+    if (not_modified := await _not_modified(request, response, *tables)) is not None:
+        return not_modified
     async with async_session() as session:
-        return await crud.get_items(session, limit=limit)
+        rows = await crud.get_items_rows(session, limit=limit if item_ids is None else None, filters=filters,
+                                         ids=item_ids)
+    if item_ids is not None:
+        return _json_map(response, crud.ITEM_FIELDS, 'id', rows)
+    return _json_rows(response, crud.ITEM_FIELDS, rows)
 
 
 @app.get('/items/{item_id}/', response_model=schemas.Item)
@@ -0,0 +1,180 @@
+import asyncio
+import logging
+import os
+import time
+from bisect import bisect_left, bisect_right
+
+from sqlalchemy import select
+
+from . import crud, metrics, models, schemas
+from .database import async_session
+
+logger = logging.getLogger(__name__)
+
+# Seconds between background reloads of the rules, picks up rules created or deleted by other processes
+ALERT_RULES_TTL = float(os.environ.get('ALERT_RULES_TTL', 60))
+
+OPS = ('<', '<=', '>', '>=')
+
+
+def crossed(op: str, thresholds: list[int], value: int, previous: int | None) -> tuple[int, int]:
+    # Slice of the sorted thresholds whose condition holds for value but did not for previous, so a rule fires once
+    # when the price crosses it and again only after the price has moved back
+    if op in ('<', '<='):
+        find = bisect_right if op == '<' else bisect_left
+        return find(thresholds, value), len(thresholds) if previous is None else find(thresholds, previous)
+    find = bisect_left if op == '>' else bisect_right
+    return 0 if previous is None else find(thresholds, previous), find(thresholds, value)
+
+
+class Thresholds:
+    __slots__ = ('values', 'rule_ids')
+
+    def __init__(self):
+        self.values: list[int] = []
+        self.rule_ids: list[int] = []
+
+    def add(self, threshold: int, rule_id: int) -> None:
+        # Parallel lists sorted by threshold
+        position = bisect_right(self.values, threshold)
+        self.values.insert(position, threshold)
+        self.rule_ids.insert(position, rule_id)
+
+    def remove(self, threshold: int, rule_id: int) -> None:
+        position = bisect_left(self.values, threshold)
+        while position < len(self.values) and self.values[position] == threshold:
+            if self.rule_ids[position] == rule_id:
+                del self.values[position]
+                del self.rule_ids[position]
+                return
+            position += 1
+
+
+class AlertEngine:
+    """Threshold rules indexed per (source, item, field, op), ingest only visits the rules a new price crossed."""
+
+    def __init__(self, max_age: float = ALERT_RULES_TTL):
+        self.max_age = max_age
+        self.loaded = 0.0
+        self.rules: dict[int, tuple] = {}
+        self.index: dict[tuple, Thresholds] = {}
+        # Last price seen per (source, item) as (time_stamp, low_price, high_price)
+        self.last: dict[tuple, tuple] = {}
+        # Called with the recorded triggers of every ingest that crossed a rule
+        self.on_trigger: list = []
+        self.evaluated = 0
+        self.triggered = 0
+        self._lock = asyncio.Lock()
+        self._refreshing: asyncio.Task | None = None
+        # Rules added or removed here while a reload is reading the table, replayed onto the reloaded index
+        self._changes: list | None = None
+
+    def add(self, rule) -> None:
+        if self._changes is not None:
+            self._changes.append((self.add, rule))
+        if rule.id in self.rules:
+            return
+        key = (rule.source, rule.item_id, rule.field, rule.op)
+        self.rules[rule.id] = (key, rule.threshold)
+        self.index.setdefault(key, Thresholds()).add(rule.threshold, rule.id)
+
+    def remove(self, rule_id: int) -> None:
+        if self._changes is not None:
+            self._changes.append((self.remove, rule_id))
+        rule = self.rules.pop(rule_id, None)
+        if rule is not None:
+            key, threshold = rule
+            self.index[key].remove(threshold, rule_id)
+
+    async def refresh(self) -> None:
+        async with self._lock:
+            if time.monotonic() - self.loaded <= self.max_age:
+                return
+
+            columns = (models.AlertRule.id, models.AlertRule.source, models.AlertRule.item_id,
+                       models.AlertRule.field, models.AlertRule.op, models.AlertRule.threshold)
+            self._changes = []
+            try:
+                async with async_session() as session:
+                    rules = (await session.execute(select(*columns).order_by(models.AlertRule.threshold,
+                                                                             models.AlertRule.id))).all()
+
+                    # Crossings are measured from the current prices, so rules already met do not fire again on
+                    # restart
+                    if not self.last:
+                        latest = await crud.get_latest_all(session, limit=None)
+                        average = await crud.get_average_all(session, limit=None)
+                        for source, rows in (('latest', latest), ('average', average)):
+                            for row in rows:
+                                self.last[(source, row.item_id)] = (row.time_stamp, row.low_price, row.high_price)
+            finally:
+                changes, self._changes = self._changes, None
+
+            # Rows arrive sorted, appending keeps every threshold list sorted without a bisect per rule
+            self.rules, self.index = {}, {}
+            for rule_id, source, item_id, field, op, threshold in rules:
+                key = (source, item_id, field, op)
+                self.rules[rule_id] = (key, threshold)
+                thresholds = self.index.setdefault(key, Thresholds())
+                thresholds.values.append(threshold)
+                thresholds.rule_ids.append(rule_id)
+            for change, argument in changes:
+                change(argument)
+            self.loaded = time.monotonic()
+
+    def _refreshed(self, task: asyncio.Task) -> None:
+        self._refreshing = None
+        if not task.cancelled() and task.exception() is not None:
+            logger.error('Alert rule reload failed', exc_info=task.exception())
+
+    def evaluate(self, source: str, rows: list[schemas.PriceRow]) -> list[dict]:
+        # Runs without awaiting so ingests never interleave
+        triggers = []
+        for item_id, time_stamp, low_price, high_price, _, _ in rows:
+            self.evaluated += 1
+            last = self.last.get((source, item_id))
+            # Late ticks neither fire nor move the reference price
+            if last is not None and last[0] > time_stamp:
+                continue
+            self.last[(source, item_id)] = (time_stamp, low_price, high_price)
+
+            for position, (field, value) in enumerate((('low_price', low_price), ('high_price', high_price))):
+                previous = last[position + 1] if last is not None else None
+                for op in OPS:
+                    thresholds = self.index.get((source, item_id, field, op))
+                    if thresholds is None or not thresholds.values:
+                        continue
+                    start, end = crossed(op, thresholds.values, value, previous)
+                    for rule_id in thresholds.rule_ids[start:end]:
+                        triggers.append({'rule_id': rule_id, 'item_id': item_id, 'price': value,
+                                         'time_stamp': time_stamp})
+
+        self.triggered += len(triggers)
+        return triggers
+
+    async def ingest(self, source: str, rows: list[schemas.PriceRow]) -> list[dict]:
+        # Only the first load is waited for, later reloads reconcile with other processes beside the ingest while
+        # the routes of this one keep the index current directly
+        if not self.loaded:
+            await self.refresh()
+        elif time.monotonic() - self.loaded > self.max_age and self._refreshing is None:
+            self._refreshing = metrics.background_task(self.refresh())
+            self._refreshing.add_done_callback(self._refreshed)
+
+        triggers = self.evaluate(source, rows)
+        if triggers:
+            async with async_session() as session:
+                await crud.create_alert_triggers(session, triggers)
+            for hook in self.on_trigger:
+                try:
+                    hook(triggers)
+                except Exception:
+                    logger.exception('Alert trigger hook failed')
+        return triggers
+
+    def stats(self) -> dict:
+        return {'rules': len(self.rules), 'evaluated': self.evaluated, 'triggered': self.triggered,
+                'age': time.monotonic() - self.loaded if self.loaded else None}
+
+
+alert_engine = AlertEngine()
@@ -0,0 +1,102 @@
+import asyncio
+import os
+import time
+
+import orjson
+
+from . import crud, models, schemas
+from .database import async_session
+
+# Seconds a cached price may lag behind writes made outside this process before the table is reloaded
+LATEST_CACHE_TTL = float(os.environ.get('LATEST_CACHE_TTL', 30))
+
+
+class PriceCache:
+    """Current Latest row per item, kept in memory and updated write-through by this process."""
+
+    def __init__(self, max_age: float = LATEST_CACHE_TTL):
+        self.max_age = max_age
+        self.prices: dict[int, schemas.Latest] = {}
+        self.loaded = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        # Bumped whenever the cached prices change, lets derived views know when to rebuild
+        self.version = 0
+        self._ordered: list[schemas.Latest] | None = None
+        # Each cached price pre-encoded as JSON, listings are joined from these without touching the models
+        self.encoded: dict[int, bytes] = {}
+        self._lock = asyncio.Lock()
+
+    @property
+    def stale(self) -> bool:
+        return time.monotonic() - self.loaded > self.max_age
+
+    async def refresh(self) -> None:
+        async with self._lock:
+            # Concurrent readers queue on the lock, only the first one needs to reload
+            if not self.stale:
+                return
+
+            async with async_session() as session:
+                rows = await crud.get_latest_all(session, limit=None)
+
+            self.prices = {row.item_id: schemas.Latest.from_orm(row) for row in rows}
+            self.encoded = {item_id: orjson.dumps(latest.dict()) for item_id, latest in self.prices.items()}
+            self._ordered = None
+            self.loaded = time.monotonic()
+            self.refreshes += 1
+            self.version += 1
+
+    def invalidate(self) -> None:
+        self.loaded = 0.0
+
+    def put(self, latest: models.Latest) -> None:
+        current = self.prices.get(latest.item_id)
+
+        # Late ticks must not replace a newer price
+        if current is None or current.time_stamp <= latest.time_stamp:
+            self.prices[latest.item_id] = schemas.Latest.from_orm(latest)
+            self.encoded[latest.item_id] = orjson.dumps(self.prices[latest.item_id].dict())
+            self._ordered = None
+            self.version += 1
+
+    async def _ensure_fresh(self) -> None:
+        if self.stale:
+            self.misses += 1
+            await self.refresh()
+        else:
+            self.hits += 1
+
+    async def get_prices(self) -> dict[int, schemas.Latest]:
+        await self._ensure_fresh()
+        return self.prices
+
+    async def get(self, item_id: int) -> schemas.Latest | None:
+        await self._ensure_fresh()
+        return self.prices.get(item_id)
+
+    async def get_all(self, limit: int = 100) -> list[schemas.Latest]:
+        await self._ensure_fresh()
+
+        if self._ordered is None:
+            self._ordered = sorted(self.prices.values(), key=lambda latest: latest.item_id, reverse=True)
+        return self._ordered[:limit]
+
+    async def get_all_json(self, limit: int = 100) -> bytes:
+        # The body get_all(limit) serializes to
+        ordered = await self.get_all(limit)
+        return b'[' + b','.join(self.encoded[latest.item_id] for latest in ordered) + b']'
+
+    async def get_many_json(self, item_ids: list[int]) -> bytes:
+        # The body of a dict[int, schemas.Latest] keyed by item id, ids without a price are left out
+        await self._ensure_fresh()
+        return b'{' + b','.join(b'"%d":%b' % (item_id, self.encoded[item_id]) for item_id in item_ids
+                                if item_id in self.encoded) + b'}'
+
+    def stats(self) -> dict:
+        return {'items': len(self.prices), 'hits': self.hits, 'misses': self.misses, 'refreshes': self.refreshes,
+                'max_age': self.max_age, 'age': time.monotonic() - self.loaded if self.loaded else None}
+
+
+latest_cache = PriceCache()
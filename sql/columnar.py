@@ -0,0 +1,140 @@
+import argparse
+import asyncio
+import json
+import os
+import shutil
+from datetime import datetime
+
+import numpy as np
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .database import async_session
+from .export import EXPORT_BATCH_SIZE, EXPORT_TABLES
+
+# Columns written per table, the time column is stored as int64 epoch seconds under the name time_stamp
+COLUMNS = {
+    'latest': {'low_price': np.int64, 'high_price': np.int64},
+    'average': {'low_price': np.int64, 'high_price': np.int64, 'low_volume': np.int64, 'high_volume': np.int64},
+    'daily': {'price': np.int64, 'volume': np.int64},
+}
+
+
+def _epoch_seconds(stamps) -> np.ndarray:
+    return np.array(stamps, dtype='datetime64[s]').astype(np.int64)
+
+
+async def write_snapshot(db: AsyncSession, path: str, table: str) -> int:
+    model, stamp_column = EXPORT_TABLES[table]
+    columns = {'item_id': np.int32, 'time_stamp': np.int64, **COLUMNS[table]}
+    stamp = getattr(model, stamp_column)
+
+    target = os.path.join(path, table)
+    staging = target + '.tmp'
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+
+    # Rows arriving after the count are left for the next snapshot
+    total = (await db.execute(select(func.count()).select_from(model))).scalar()
+    arrays = {name: np.lib.format.open_memmap(os.path.join(staging, f'{name}.npy'), mode='w+', dtype=dtype,
+                                              shape=(total,)) for name, dtype in columns.items()}
+
+    # (item_id, stamp) order walks the unique index, each item's rows end up contiguous and sorted by time
+    stmt = select(model.item_id, stamp, *(getattr(model, name) for name in COLUMNS[table])).order_by(
+        model.item_id, stamp).execution_options(yield_per=EXPORT_BATCH_SIZE)
+
+    items, starts = [], []
+    count, last_item = 0, None
+    result = await db.stream(stmt)
+    async for rows in result.partitions(EXPORT_BATCH_SIZE):
+        rows = rows[:total - count]
+        if not rows:
+            break
+
+        chunk = list(zip(*rows))
+        item_ids = np.array(chunk[0], dtype=np.int32)
+        for index in np.flatnonzero(np.diff(item_ids, prepend=-1 if last_item is None else last_item)):
+            items.append(int(item_ids[index]))
+            starts.append(count + int(index))
+
+        arrays['item_id'][count:count + len(rows)] = item_ids
+        arrays['time_stamp'][count:count + len(rows)] = _epoch_seconds(chunk[1])
+        for name, values in zip(COLUMNS[table], chunk[2:]):
+            arrays[name][count:count + len(rows)] = values
+
+        count += len(rows)
+        last_item = int(item_ids[-1])
+    await result.close()
+
+    for array in arrays.values():
+        array.flush()
+    np.save(os.path.join(staging, 'items.npy'), np.array(items, dtype=np.int32))
+    np.save(os.path.join(staging, 'offsets.npy'), np.array(starts + [count], dtype=np.int64))
+    with open(os.path.join(staging, 'meta.json'), 'w') as f:
+        json.dump({'table': table, 'rows': count, 'columns': list(columns), 'created': datetime.utcnow().isoformat()},
+                  f)
+
+    # Swap directories so readers never see a partial snapshot, open maps of the old files stay valid
+    retired = target + '.old'
+    shutil.rmtree(retired, ignore_errors=True)
+    if os.path.exists(target):
+        os.rename(target, retired)
+    os.rename(staging, target)
+    shutil.rmtree(retired, ignore_errors=True)
+
+    return count
+
+
+class ColumnarReader:
+    """Memory-mapped view of one table snapshot, reads return zero-copy slices of the column files."""
+
+    def __init__(self, path: str, table: str):
+        directory = os.path.join(path, table)
+        with open(os.path.join(directory, 'meta.json')) as f:
+            self.meta = json.load(f)
+
+        rows = self.meta['rows']
+        self.columns = {name: np.load(os.path.join(directory, f'{name}.npy'), mmap_mode='r')[:rows]
+                        for name in self.meta['columns']}
+        self.items = np.load(os.path.join(directory, 'items.npy'))
+        self.offsets = np.load(os.path.join(directory, 'offsets.npy'))
+
+    def _bounds(self, item_id: int) -> tuple[int, int]:
+        position = np.searchsorted(self.items, item_id)
+        if position == len(self.items) or self.items[position] != item_id:
+            return 0, 0
+        return int(self.offsets[position]), int(self.offsets[position + 1])
+
+    def read(self, item_id: int, start: datetime | int | None = None,
+             end: datetime | int | None = None) -> dict[str, np.ndarray]:
+        lower, upper = self._bounds(item_id)
+        stamps = self.columns['time_stamp'][lower:upper]
+
+        # start and end are inclusive, like the history endpoints
+        if start is not None:
+            start = _epoch_seconds([start])[0] if isinstance(start, datetime) else start
+            lower += int(np.searchsorted(stamps, start, side='left'))
+        if end is not None:
+            end = _epoch_seconds([end])[0] if isinstance(end, datetime) else end
+            upper -= len(stamps) - int(np.searchsorted(stamps, end, side='right'))
+
+        return {name: column[lower:upper] for name, column in self.columns.items()}
+
+
+async def main():
+    parser = argparse.ArgumentParser(description='Write memory-mappable columnar snapshots of the price tables')
+    parser.add_argument('path', help='directory receiving one sub-directory per table')
+    parser.add_argument('tables', nargs='*', help=f"any of {', '.join(COLUMNS)} (default all)")
+    args = parser.parse_args()
+
+    unknown = set(args.tables) - set(COLUMNS)
+    if unknown:
+        parser.error(f"unknown tables: {', '.join(sorted(unknown))}")
+
+    async with async_session() as session:
+        for table in args.tables or COLUMNS:
+            print(f'{table}: {await write_snapshot(session, args.path, table)} rows written')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
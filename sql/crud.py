@@ -1,10 +1,51 @@
-from sqlalchemy.orm import selectinload
+import base64
+import os
+
+from sqlalchemy.orm import aliased, selectinload
+from sqlalchemy.orm.attributes import set_committed_value
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from sqlalchemy import select, update
+from sqlalchemy import (BigInteger, Date, DateTime, Float, Integer, case, cast, func, insert, literal, select, true,
+                        update)
+from sqlalchemy.dialects import postgresql, sqlite
+
+from . import metrics, models, schemas
+from datetime import date, datetime, timedelta
+
+# Volume filters sum Average volumes over this window, the same buy limit window /flips/ uses
+FILTER_VOLUME_WINDOW = timedelta(hours=float(os.environ.get('FLIP_VOLUME_HOURS', 4)))
+
+# Rows per INSERT statement in the bulk paths, kept well below the bind parameter limits of asyncpg and SQLite
+BULK_CHUNK_SIZE = 1000
+
+# Ids accepted by one multi-get, each is a bind parameter of a single IN list so this stays well below the limits of
+# asyncpg (32767) and SQLite (32766)
+MULTI_GET_MAX_IDS = int(os.environ.get('MULTI_GET_MAX_IDS', 5000))
+
+# Column order of the plain row reads, matching the response schemas field for field
+ITEM_FIELDS = tuple(schemas.Item.__fields__)
+LATEST_FIELDS = tuple(schemas.Latest.__fields__)
+AVERAGE_FIELDS = tuple(schemas.Average.__fields__)
+
+# Relationships embedded by the full item reads as (model, column matching the item, newest first ordering)
+FULL_RELATIONS = {
+    'categories': (models.Category, 'item_id', 'id'),
+    'latest': (models.Latest, 'item_id', 'time_stamp'),
+    'average': (models.Average, 'item_id', 'time_stamp'),
+    'daily': (models.Daily, 'item_id', 'date_stamp'),
+    'production': (models.Production, 'item_id', 'id'),
+    'materials': (models.Material, 'name', 'id'),
+}
 
-from . import models, schemas
-from datetime import datetime
+FULL_RELATION_FIELDS = {relation: tuple(schemas.ItemFull.__fields__[relation].type_.__fields__)
+                        for relation in FULL_RELATIONS}
+
+# Most recent rows embedded per relationship and item, ITEMS_FULL_<RELATION>_LIMIT overrides the default
+FULL_RELATION_LIMITS = {
+    relation: int(os.environ.get(f'ITEMS_FULL_{relation.upper()}_LIMIT', default))
+    for relation, default in {'categories': 50, 'latest': 60, 'average': 288, 'daily': 90, 'production': 50,
+                              'materials': 50}.items()
+}
 
 
 async def round_to_nearest(timestamp, timestep):
@@ -15,9 +56,98 @@ async def round_to_nearest(timestamp, timestep):
     return dt_rounded
 
 
+def encode_cursor(stamp: datetime | date) -> str:
+    return base64.urlsafe_b64encode(stamp.isoformat().encode()).decode()
+
+
+def decode_cursor(cursor: str, stamp_type: type = datetime) -> datetime | date:
+    # Raises ValueError (or a subclass of it) for cursors that were not produced by encode_cursor
+    return stamp_type.fromisoformat(base64.urlsafe_b64decode(cursor.encode()).decode())
+
+
+async def _history(db: AsyncSession, model, order_column: str, item_id: int, start=None, end=None,
+                   limit: int | None = None, before=None, criteria: tuple = ()) -> list:
+    # Newest first range scan over the unique (item_id, <order_column>) index, before is the keyset cursor
+    column = getattr(model, order_column)
+    stmt = select(model).where(model.item_id == item_id, *criteria)
+
+    if start is not None:
+        stmt = stmt.where(column >= start)
+    if end is not None:
+        stmt = stmt.where(column <= end)
+    if before is not None:
+        stmt = stmt.where(column < before)
+
+    result = await db.execute(stmt.order_by(column.desc()).limit(limit))
+    return result.scalars().all()
+
+
+def _insert(db: AsyncSession, model):
+    # ON CONFLICT is dialect specific, pick the insert construct matching the bound engine
+    if db.bind.dialect.name == 'postgresql':
+        return postgresql.insert(model)
+    return sqlite.insert(model)
+
+
+async def bulk_upsert(db: AsyncSession, model, rows: list[dict], keys: tuple[str, ...],
+                       on_conflict: str = 'update') -> schemas.BulkResult:
+    now = datetime.utcnow()
+
+    # A single statement may not touch the same conflict target twice, the last row for a key wins
+    deduped = {tuple(row[key] for key in keys): {**row, 'created': now, 'updated': now} for row in rows}
+    rows = list(deduped.values())
+    update_columns = [column for column in rows[0] if column not in (*keys, 'created')] if rows else []
+
+    result = schemas.BulkResult(received=len(deduped))
+    for start in range(0, len(rows), BULK_CHUNK_SIZE):
+        chunk = rows[start:start + BULK_CHUNK_SIZE]
+
+        stmt = select(*(getattr(model, key) for key in keys)).where(
+            *(getattr(model, key).in_({row[key] for row in chunk}) for key in keys))
+        existing = set((await db.execute(stmt)).all())
+        updated = sum(tuple(row[key] for key in keys) in existing for row in chunk)
+
+        stmt = _insert(db, model).values(chunk)
+        if on_conflict == 'ignore':
+            stmt = stmt.on_conflict_do_nothing(index_elements=keys)
+            result.skipped += updated
+        else:
+            stmt = stmt.on_conflict_do_update(index_elements=keys,
+                                              set_={column: stmt.excluded[column] for column in update_columns})
+            result.updated += updated
+        await db.execute(stmt)
+
+        result.inserted += len(chunk) - updated
+        result.batches += 1
+
+    if rows:
+        await bump_data_version(db, model.__tablename__)
+    await db.commit()
+    return result
+
+
+async def _plain(db: AsyncSession, stmt, model, fields: tuple[str, ...]) -> list:
+    # Same statement returning bare column tuples in response field order, skips ORM instances and the identity map.
+    # No load event fires for these, so they are counted towards the request's rows here
+    result = await db.execute(stmt.with_only_columns(*(model.__table__.c[field] for field in fields)))
+    rows = result.all()
+    metrics.rows_loaded(len(rows))
+    return rows
+
+
+def _newest_per_item(model, order_column: str, item_criteria=()):
+    # One top-1 probe per item, each a backwards scan of the unique (item_id, <order_column>) index
+    newest = aliased(model)
+    newest_id = select(newest.id).where(newest.item_id == models.Items.id).order_by(
+        getattr(newest, order_column).desc()).limit(1).correlate(models.Items).scalar_subquery()
+    stmt = select(model).where(model.id.in_(select(newest_id).select_from(models.Items).where(*item_criteria)))
+    return stmt.order_by(model.item_id.desc())
+
+
 async def create_item(db: AsyncSession, item: schemas.ItemCreate) -> models.Items:
     db_item = models.Items(**item.dict())
     db.add(db_item)
+    await bump_data_version(db, 'items')
     await db.commit()
     return db_item
 
@@ -27,32 +157,113 @@ async def get_item(db: AsyncSession, item_id: int) -> models.Items:
     return result
 
 
-# Write get_items() to pull all items, with limit and filters
-async def get_items(db: AsyncSession, limit: int = 100) -> list[models.Items]:
-    stmt = select(models.Items).order_by(models.Items.id.asc()).limit(limit)
-    result = await db.execute(stmt)
+def _newest_price():
+    # Top-1 probe of the unique (item_id, time_stamp) index, prices filter on the low (buy) price like /flips/
+    return select(models.Latest.low_price).where(models.Latest.item_id == models.Items.id).order_by(
+        models.Latest.time_stamp.desc()).limit(1).correlate(models.Items).scalar_subquery()
+
+
+def _item_criteria(filters: schemas.ItemFilter | None, price: bool = True) -> list:
+    # Criteria on Items, meant for statements selecting from items, each one is skipped when its filter is unset
+    if filters is None:
+        return []
+
+    criteria = []
+    if filters.category is not None:
+        criteria.append(models.Items.id.in_(select(models.Category.item_id).where(
+            models.Category.name == filters.category)))
+    if filters.members is not None:
+        criteria.append(models.Items.members == filters.members)
+    for column, lower, upper in ((models.Items.limit, filters.min_limit, filters.max_limit),
+                                 (models.Items.high_alch, filters.min_high_alch, filters.max_high_alch),
+                                 (_newest_price() if price else None, filters.min_price, filters.max_price)):
+        if column is not None and lower is not None:
+            criteria.append(column >= lower)
+        if column is not None and upper is not None:
+            criteria.append(column <= upper)
+    if filters.min_volume is not None:
+        since = datetime.utcnow() - FILTER_VOLUME_WINDOW
+        volume = select(func.sum(models.Average.low_volume + models.Average.high_volume)).where(
+            models.Average.item_id == models.Items.id, models.Average.time_stamp >= since).correlate(
+            models.Items).scalar_subquery()
+        criteria.append(volume >= filters.min_volume)
+    return criteria
+
+
+def _items(limit: int | None, filters: schemas.ItemFilter | None, ids: list[int] | None = None):
+    stmt = select(models.Items).where(*_item_criteria(filters))
+    if ids is not None:
+        stmt = stmt.where(models.Items.id.in_(ids))
+    return stmt.order_by(models.Items.id.asc()).limit(limit)
+
+
+async def get_items(db: AsyncSession, limit: int = 100, filters: schemas.ItemFilter | None = None,
+                    ids: list[int] | None = None) -> list[models.Items]:
+    result = await db.execute(_items(limit, filters, ids))
     return result.scalars().all()
 
 
-# Write functions to get full items (with all loaded relationships)
-async def get_items_full(db: AsyncSession, limit: int = 100) -> list[models.Items]:
-    stmt = select(models.Items).limit(limit).options(
-        selectinload(models.Items.categories), selectinload(models.Items.latest),
-        selectinload(models.Items.average), selectinload(models.Items.daily),
-        selectinload(models.Items.production), selectinload(models.Items.materials)
-    )
-    result = await db.execute(stmt)
+async def get_items_rows(db: AsyncSession, limit: int | None = 100, filters: schemas.ItemFilter | None = None,
+                         ids: list[int] | None = None) -> list:
+    return await _plain(db, _items(limit, filters, ids), models.Items, ITEM_FIELDS)
+
+
+async def _top_per_item(db: AsyncSession, relation: str, keys: list, limit: int) -> list:
+    model, key_column, order_column = FULL_RELATIONS[relation]
+    key = getattr(model, key_column)
+    order = getattr(model, order_column)
+
+    # Both read at most `limit` index entries per item, however long its history
+    item_key = getattr(models.Items, 'name' if key_column == 'name' else 'id')
+    if db.bind.dialect.name == 'postgresql':
+        top = select(model).where(key == item_key).order_by(order.desc()).limit(limit).lateral()
+        row = aliased(model, top)
+        stmt = select(row).select_from(models.Items).join(top, true()).where(item_key.in_(keys))
+    else:
+        # Without LATERAL, a correlated probe per item whose ids are then fetched by primary key
+        probe = aliased(model)
+        top_ids = select(probe.id).where(getattr(probe, key_column) == item_key).order_by(
+            getattr(probe, order_column).desc()).limit(limit).correlate(models.Items)
+        row = model
+        stmt = select(model).select_from(models.Items).join(model, model.id.in_(top_ids)).where(item_key.in_(keys))
+
+    result = await db.execute(stmt.order_by(getattr(row, key_column), getattr(row, order_column).desc()))
     return result.scalars().all()
 
 
-async def get_item_full(db: AsyncSession, item_id) -> models.Items:
-    stmt = select(models.Items).filter(models.Items.id == item_id).options(
-        selectinload(models.Items.categories), selectinload(models.Items.latest),
-        selectinload(models.Items.average), selectinload(models.Items.daily),
-        selectinload(models.Items.production), selectinload(models.Items.materials)
-    )
+async def _load_full(db: AsyncSession, items: list[models.Items], include: set[str] | None = None,
+                     limits: dict[str, int] | None = None) -> None:
+    # Populates the relationship collections in place with bounded lists, relations left out are set empty
+    limits = {**FULL_RELATION_LIMITS, **(limits or {})}
+
+    for relation, (model, key_column, order_column) in FULL_RELATIONS.items():
+        item_key = 'name' if key_column == 'name' else 'id'
+        grouped = {}
+
+        if items and (include is None or relation in include):
+            rows = await _top_per_item(db, relation, [getattr(item, item_key) for item in items], limits[relation])
+            for row in rows:
+                grouped.setdefault(getattr(row, key_column), []).append(row)
+
+        for item in items:
+            set_committed_value(item, relation, grouped.get(getattr(item, item_key), []))
+
+
+async def get_items_full(db: AsyncSession, limit: int = 100, include: set[str] | None = None,
+                         limits: dict[str, int] | None = None) -> list[models.Items]:
+    stmt = select(models.Items).order_by(models.Items.id.asc()).limit(limit)
     result = await db.execute(stmt)
-    return result.scalars().first()
+    items = result.scalars().all()
+    await _load_full(db, items, include=include, limits=limits)
+    return items
+
+
+async def get_item_full(db: AsyncSession, item_id, include: set[str] | None = None,
+                        limits: dict[str, int] | None = None) -> models.Items:
+    result = await db.get(models.Items, item_id)
+    if result is not None:
+        await _load_full(db, [result], include=include, limits=limits)
+    return result
 
 
 async def update_item(db: AsyncSession, item: schemas.ItemCreate) -> None:
@@ -99,26 +310,47 @@ async def create_latest(db: AsyncSession, latest: schemas.LatestCreate) -> model
     latest.time_stamp = await round_to_nearest(latest.time_stamp, 1)
     db_add = models.Latest(**latest.dict())
     db.add(db_add)
+    await bump_data_version(db, 'latest')
     await db.commit()
     await db.refresh(db_add)
     return db_add
 
 
+async def create_latest_bulk(db: AsyncSession, bulk: schemas.LatestBulkCreate) -> schemas.BulkResult:
+    time_stamp = await round_to_nearest(bulk.time_stamp, 1)
+    rows = [{**latest.dict(), 'time_stamp': time_stamp} for latest in bulk.data]
+    return await bulk_upsert(db, models.Latest, rows, ('item_id', 'time_stamp'))
+
+
 async def get_latest(db: AsyncSession, latest_id: int) -> models.Latest:
     result = await db.get(models.Latest, latest_id)
     return result
 
 
-async def get_latest_all(db: AsyncSession, limit: int = 100) -> list[models.Latest]:
-    stmt = select(models.Latest).distinct(models.Latest.item_id).order_by(models.Latest.item_id.desc()).limit(limit)
-    result = await db.execute(stmt)
+def _latest_all(limit: int | None, filters: schemas.ItemFilter | None):
+    # The price range applies to the selected newest rows directly instead of probing for them twice
+    stmt = _newest_per_item(models.Latest, 'time_stamp', _item_criteria(filters, price=False))
+    if filters is not None and filters.min_price is not None:
+        stmt = stmt.where(models.Latest.low_price >= filters.min_price)
+    if filters is not None and filters.max_price is not None:
+        stmt = stmt.where(models.Latest.low_price <= filters.max_price)
+    return stmt.limit(limit)
+
+
+async def get_latest_all(db: AsyncSession, limit: int = 100,
+                         filters: schemas.ItemFilter | None = None) -> list[models.Latest]:
+    result = await db.execute(_latest_all(limit, filters))
     return result.scalars().all()
 
 
-async def get_latest_by_item(db: AsyncSession, item_id: int) -> list[models.Latest]:
-    stmt = select(models.Items).filter(models.Items.id == item_id).options(selectinload(models.Items.latest))
-    result = await db.execute(stmt)
-    return result.scalars().first().latest
+async def get_latest_all_rows(db: AsyncSession, limit: int = 100, filters: schemas.ItemFilter | None = None) -> list:
+    return await _plain(db, _latest_all(limit, filters), models.Latest, LATEST_FIELDS)
+
+
+async def get_latest_by_item(db: AsyncSession, item_id: int, start: datetime | None = None,
+                             end: datetime | None = None, limit: int | None = None,
+                             before: datetime | None = None) -> list[models.Latest]:
+    return await _history(db, models.Latest, 'time_stamp', item_id, start=start, end=end, limit=limit, before=before)
 
 
 async def delete_latest(db: AsyncSession, latest_id: int) -> None:
@@ -133,26 +365,45 @@ async def create_average(db: AsyncSession, average: schemas.AverageCreate) -> mo
     average.time_stamp = await round_to_nearest(average.time_stamp, 1)
     db_add = models.Average(**average.dict())
     db.add(db_add)
+    await bump_data_version(db, 'average')
     await db.commit()
     await db.refresh(db_add)
     return db_add
 
 
+async def create_average_bulk(db: AsyncSession, bulk: schemas.AverageBulkCreate,
+                              on_conflict: str = 'update') -> schemas.BulkResult:
+    time_stamp = await round_to_nearest(bulk.time_stamp, 1)
+    rows = [{**average.dict(), 'time_stamp': time_stamp} for average in bulk.data]
+    return await bulk_upsert(db, models.Average, rows, ('item_id', 'time_stamp'), on_conflict=on_conflict)
+
+
 async def get_average(db: AsyncSession, average_id: int) -> models.Average:
     result = await db.get(models.Average, average_id)
     return result
 
 
 async def get_average_all(db: AsyncSession, limit: int = 100) -> list[models.Average]:
-    stmt = select(models.Average).distinct(models.Average.item_id).order_by(models.Average.item_id.desc()).limit(limit)
+    stmt = _newest_per_item(models.Average, 'time_stamp').limit(limit)
     result = await db.execute(stmt)
     return result.scalars().all()
 
 
-async def get_average_by_item(db: AsyncSession, item_id: int) -> list[schemas.Average]:
-    stmt = select(models.Items).filter(models.Items.id == item_id).options(selectinload(models.Items.average))
-    result = await db.execute(stmt)
-    return result.scalars().first().average
+async def get_average_all_rows(db: AsyncSession, limit: int = 100) -> list:
+    stmt = _newest_per_item(models.Average, 'time_stamp').limit(limit)
+    return await _plain(db, stmt, models.Average, AVERAGE_FIELDS)
+
+
+async def get_average_current_rows(db: AsyncSession, ids: list[int]) -> list:
+    # Newest bucket of each requested item, one top-1 index probe per id
+    stmt = _newest_per_item(models.Average, 'time_stamp', (models.Items.id.in_(ids),))
+    return await _plain(db, stmt, models.Average, AVERAGE_FIELDS)
+
+
+async def get_average_by_item(db: AsyncSession, item_id: int, start: datetime | None = None,
+                              end: datetime | None = None, limit: int | None = None,
+                              before: datetime | None = None) -> list[models.Average]:
+    return await _history(db, models.Average, 'time_stamp', item_id, start=start, end=end, limit=limit, before=before)
 
 
 async def delete_average(db: AsyncSession, average_id: int) -> None:
@@ -166,6 +417,7 @@ async def delete_average(db: AsyncSession, average_id: int) -> None:
 async def create_daily(db: AsyncSession, daily: schemas.DailyCreate) -> models.Daily:
     db_add = models.Daily(**daily.dict())
     db.add(db_add)
+    await bump_data_version(db, 'daily')
     await db.commit()
     await db.refresh(db_add)
     return db_add
@@ -177,15 +429,49 @@ async def get_daily(db: AsyncSession, daily_id: int) -> models.Daily:
 
 
 async def get_daily_all(db: AsyncSession, limit: int = 100) -> list[models.Daily]:
-    stmt = select(models.Daily).distinct(models.Daily.item_id).order_by(models.Daily.item_id.desc()).limit(limit)
+    stmt = _newest_per_item(models.Daily, 'date_stamp').limit(limit)
     result = await db.execute(stmt)
     return result.scalars().all()
 
 
-async def get_daily_by_item(db: AsyncSession, item_id: int) -> list[schemas.Daily]:
-    stmt = select(models.Items).filter(models.Items.id == item_id).options(selectinload(models.Items.daily))
+async def get_daily_by_item(db: AsyncSession, item_id: int, start: date | None = None,
+                            end: date | None = None, limit: int | None = None,
+                            before: date | None = None) -> list[models.Daily]:
+    return await _history(db, models.Daily, 'date_stamp', item_id, start=start, end=end, limit=limit, before=before)
+
+
+def _daily_from_average(start: datetime, end: datetime):
+    average = models.Average
+    day = func.date(average.time_stamp, type_=Date)
+    volume = func.sum(average.low_volume + average.high_volume)
+
+    # Volume weighted over both sides, days without any volume fall back to the mean mid price. Products are widened
+    # first, price times volume overflows a 32 bit integer on PostgreSQL
+    weighted = func.sum(cast(average.low_price, BigInteger) * average.low_volume +
+                        cast(average.high_price, BigInteger) * average.high_volume)
+    mid = case((average.low_price == 0, average.high_price), (average.high_price == 0, average.low_price),
+               else_=(average.low_price + average.high_price) / 2.0)
+    price = func.coalesce(cast(weighted, Float) / func.nullif(volume, 0), func.avg(mid))
+
+    now = datetime.utcnow()
+    stmt = select(average.item_id, day.label('date_stamp'), cast(func.round(price), Integer).label('price'),
+                  volume.label('volume'), literal(now, DateTime).label('created'),
+                  literal(now, DateTime).label('updated'))
+    return stmt.where(average.time_stamp >= start, average.time_stamp < end).group_by(average.item_id, day)
+
+
+async def aggregate_daily(db: AsyncSession, start: date, end: date, commit: bool = True) -> int:
+    # Days in [start, end) are recomputed in one INSERT ... SELECT ... GROUP BY, replacing rows already there
+    columns = ('item_id', 'date_stamp', 'price', 'volume', 'created', 'updated')
+    days = _daily_from_average(*(datetime(day.year, day.month, day.day) for day in (start, end)))
+    stmt = _insert(db, models.Daily).from_select(columns, days)
+    stmt = stmt.on_conflict_do_update(index_elements=('item_id', 'date_stamp'),
+                                      set_={column: stmt.excluded[column] for column in ('price', 'volume', 'updated')})
     result = await db.execute(stmt)
-    return result.scalars().first().daily
+    await bump_data_version(db, 'daily')
+    if commit:
+        await db.commit()
+    return result.rowcount
 
 
 async def delete_daily(db: AsyncSession, daily_id: int) -> None:
@@ -196,6 +482,13 @@ async def delete_daily(db: AsyncSession, daily_id: int) -> None:
         await db.commit()
 
 
+async def get_candles_by_item(db: AsyncSession, item_id: int, interval: str, start: datetime | None = None,
+                              end: datetime | None = None, limit: int | None = None,
+                              before: datetime | None = None) -> list[models.Candle]:
+    return await _history(db, models.Candle, 'time_stamp', item_id, start=start, end=end, limit=limit, before=before,
+                          criteria=(models.Candle.interval == interval,))
+
+
 async def create_production(db: AsyncSession, prod: schemas.ProductionCreate) -> models.Production:
     db_add = models.Production(**prod.dict())
     db.add(db_add)
@@ -285,3 +578,59 @@ async def delete_material(db: AsyncSession, material_id: int) -> None:
     if result is not None:
         await db.delete(result)
         await db.commit()
+
+
+async def create_alert_rule(db: AsyncSession, rule: schemas.AlertRuleCreate) -> models.AlertRule:
+    db_add = models.AlertRule(**rule.dict())
+    db.add(db_add)
+    await db.commit()
+    await db.refresh(db_add)
+    return db_add
+
+
+async def get_alert_rule(db: AsyncSession, rule_id: int) -> models.AlertRule:
+    result = await db.get(models.AlertRule, rule_id)
+    return result
+
+
+async def delete_alert_rule(db: AsyncSession, rule_id: int) -> models.AlertRule | None:
+    result = await db.get(models.AlertRule, rule_id)
+
+    if result is not None:
+        await db.delete(result)
+        await db.commit()
+    return result
+
+
+async def create_alert_triggers(db: AsyncSession, triggers: list[dict]) -> None:
+    if triggers:
+        await db.execute(insert(models.AlertTrigger), [{**trigger, 'created': datetime.utcnow()}
+                                                       for trigger in triggers])
+        await db.commit()
+
+
+async def get_alert_triggers(db: AsyncSession, rule_id: int, limit: int | None = None,
+                             before: datetime | None = None) -> list[models.AlertTrigger]:
+    # Newest first over the (rule_id, time_stamp) index, before is the keyset cursor
+    stmt = select(models.AlertTrigger).where(models.AlertTrigger.rule_id == rule_id)
+    if before is not None:
+        stmt = stmt.where(models.AlertTrigger.time_stamp < before)
+
+    result = await db.execute(stmt.order_by(models.AlertTrigger.time_stamp.desc()).limit(limit))
+    return result.scalars().all()
+
+
+async def bump_data_version(db: AsyncSession, *tables: str) -> None:
+    # Advances the shared write sequences inside the caller's transaction, they commit or roll back with its write
+    stmt = _insert(db, models.DataVersion).values([{'name': table, 'sequence': 1, 'modified': datetime.utcnow()}
+                                                   for table in tables])
+    stmt = stmt.on_conflict_do_update(index_elements=('name',), set_={
+        'sequence': models.DataVersion.sequence + 1, 'modified': stmt.excluded.modified})
+    await db.execute(stmt)
+    db.sync_session.info.setdefault('versions', set()).update(tables)
+
+
+async def get_data_versions(db: AsyncSession) -> list:
+    stmt = select(models.DataVersion.name, models.DataVersion.sequence, models.DataVersion.modified)
+    result = await db.execute(stmt)
+    return result.all()
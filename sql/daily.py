@@ -0,0 +1,65 @@
+import argparse
+import asyncio
+import os
+import time
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import crud, models, rollup
+from .database import async_session
+
+# Days aggregated per statement and transaction when catching up or backfilling
+DAILY_CHUNK_DAYS = int(os.environ.get('DAILY_CHUNK_DAYS', 7))
+
+WATERMARK = 'daily'
+
+
+async def backfill(db: AsyncSession, start: date, end: date, chunk_days: int = DAILY_CHUNK_DAYS,
+                   watermark: bool = False) -> dict:
+    started = time.perf_counter()
+    rows = chunks = 0
+    while start < end:
+        chunk_end = min(start + timedelta(days=chunk_days), end)
+        rows += await crud.aggregate_daily(db, start, chunk_end, commit=False)
+        if watermark:
+            # Committed in the same transaction as the days it covers
+            await db.merge(models.Watermark(name=WATERMARK, time_stamp=datetime(chunk_end.year, chunk_end.month,
+                                                                                chunk_end.day)))
+        await db.commit()
+        chunks += 1
+        start = chunk_end
+    return {'rows': rows, 'chunks': chunks, 'seconds': time.perf_counter() - started}
+
+
+async def aggregate_pending(db: AsyncSession, today: date | None = None, chunk_days: int = DAILY_CHUNK_DAYS) -> dict:
+    # Every complete day since the last run, the current day is left until it has closed even if a later one is asked
+    end = min(today or datetime.utcnow().date(), datetime.utcnow().date())
+    mark = await rollup.get_watermark(db, WATERMARK)
+    if mark is None:
+        mark = (await db.execute(select(func.min(models.Average.time_stamp)))).scalar()
+    start = mark.date() if mark is not None else end
+    return await backfill(db, start, end, chunk_days=chunk_days, watermark=True)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description='Aggregate Average buckets into Daily rows')
+    parser.add_argument('--start', type=date.fromisoformat, help='first day to backfill (default: since the last run)')
+    parser.add_argument('--end', type=date.fromisoformat, help='day after the last one to aggregate (default: today)')
+    parser.add_argument('--chunk-days', type=int, default=DAILY_CHUNK_DAYS, help='days per statement')
+    args = parser.parse_args()
+
+    if args.chunk_days < 1:
+        parser.error('--chunk-days must be at least 1')
+
+    async with async_session() as session:
+        if args.start is not None:
+            result = await backfill(session, args.start, args.end or datetime.utcnow().date(), args.chunk_days)
+        else:
+            result = await aggregate_pending(session, today=args.end, chunk_days=args.chunk_days)
+    print(f"{result['rows']} daily rows written in {result['chunks']} chunks, {result['seconds']:.2f}s")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
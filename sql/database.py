@@ -8,7 +8,10 @@ from dotenv import load_dotenv
 load_dotenv()
 DB_URL = os.environ['DB_URL']
 
-engine = create_async_engine(DB_URL, echo=True, future=True)
+# Statement logging is opt-in, per route SQL counts and timings are exported at /metrics
+DB_ECHO = os.environ.get('DB_ECHO', '').lower() in ('1', 'true', 'yes')
+
+engine = create_async_engine(DB_URL, echo=DB_ECHO, future=True)
 Base = declarative_base()
 
 async_session = sessionmaker(
@@ -0,0 +1,63 @@
+import csv
+import io
+import json
+from datetime import date, datetime
+
+from sqlalchemy import select
+
+from . import models
+from .database import async_session
+
+EXPORT_TABLES = {'latest': (models.Latest, 'time_stamp'), 'average': (models.Average, 'time_stamp'),
+                 'daily': (models.Daily, 'date_stamp')}
+
+MEDIA_TYPES = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+
+# Rows fetched per round trip from the server side cursor, and encoded per chunk of the response
+EXPORT_BATCH_SIZE = 1000
+
+
+def _isoformat(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    raise TypeError(f'Cannot serialize {type(value).__name__}')
+
+
+def _ndjson(columns: list[str], rows) -> str:
+    return ''.join(json.dumps(dict(zip(columns, row)), default=_isoformat) + '\n' for row in rows)
+
+
+def _csv(columns: list[str], rows) -> str:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows([value.isoformat() if isinstance(value, (date, datetime)) else value
+                                  for value in row] for row in rows)
+    return buffer.getvalue()
+
+
+async def stream(table: str, fmt: str = 'ndjson', start: datetime | None = None, end: datetime | None = None,
+                 item_id: int | None = None):
+    model, stamp_column = EXPORT_TABLES[table]
+    columns = [column.name for column in model.__table__.columns]
+    stamp = getattr(model, stamp_column)
+
+    if stamp_column == 'date_stamp':
+        start, end = (value.date() if value is not None else None for value in (start, end))
+
+    # Core select in primary key order, rows start flowing without sorting or ORM identity bookkeeping
+    stmt = select(model.__table__)
+    if start is not None:
+        stmt = stmt.where(stamp >= start)
+    if end is not None:
+        stmt = stmt.where(stamp <= end)
+    if item_id is not None:
+        stmt = stmt.where(model.item_id == item_id)
+    stmt = stmt.order_by(model.id).execution_options(yield_per=EXPORT_BATCH_SIZE)
+
+    encode = _ndjson if fmt == 'ndjson' else _csv
+    if fmt == 'csv':
+        yield _csv(columns, [columns])
+
+    async with async_session() as session:
+        result = await session.stream(stmt)
+        async for rows in result.partitions(EXPORT_BATCH_SIZE):
+            yield encode(columns, rows)
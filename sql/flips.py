@@ -0,0 +1,136 @@
+import asyncio
+import os
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+from sqlalchemy import func, select
+
+from . import models
+from .cache import PriceCache, latest_cache
+from .database import async_session
+
+# Grand Exchange tax on the sell side, rounded down per item and capped
+GE_TAX_RATE = 0.02
+GE_TAX_CAP = 5_000_000
+
+# Volume is summed over one buy limit window
+FLIP_VOLUME_WINDOW = timedelta(hours=float(os.environ.get('FLIP_VOLUME_HOURS', 4)))
+
+# Seconds between reloads of item limits and volumes, prices follow the price cache directly
+FLIP_SNAPSHOT_TTL = float(os.environ.get('FLIP_SNAPSHOT_TTL', 60))
+
+SORT_KEYS = ('profit', 'roi', 'margin', 'volume', 'liquidity')
+
+
+def ge_tax(price: np.ndarray) -> np.ndarray:
+    return np.minimum(np.floor(price * GE_TAX_RATE), GE_TAX_CAP)
+
+
+class FlipScanner:
+    """Column arrays over every item, flips for all items are computed in one vectorized pass."""
+
+    def __init__(self, prices: PriceCache, max_age: float = FLIP_SNAPSHOT_TTL):
+        self.prices = prices
+        self.max_age = max_age
+        self.loaded = 0.0
+        self.price_version = None
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.names = np.zeros(0, dtype=object)
+        self.limits = np.zeros(0)
+        self.members = np.zeros(0, dtype=bool)
+        self.volumes = np.zeros(0)
+        self.low = np.zeros(0)
+        self.high = np.zeros(0)
+        self._positions: dict[int, int] = {}
+        self._lock = asyncio.Lock()
+
+    async def _load_items(self) -> None:
+        since = datetime.utcnow() - FLIP_VOLUME_WINDOW
+
+        # Per item range scan on the unique (item_id, time_stamp) index rather than one scan over all of average
+        volume = select(func.sum(models.Average.low_volume + models.Average.high_volume)).where(
+            models.Average.item_id == models.Items.id, models.Average.time_stamp >= since).scalar_subquery()
+        stmt = select(models.Items.id, models.Items.name, models.Items.limit, models.Items.members, volume).order_by(
+            models.Items.id)
+
+        async with async_session() as session:
+            rows = (await session.execute(stmt)).all()
+
+        self.ids = np.array([row[0] for row in rows], dtype=np.int64)
+        self.names = np.array([row[1] for row in rows], dtype=object)
+        self.limits = np.array([row[2] or 0 for row in rows], dtype=np.float64)
+        self.members = np.array([bool(row[3]) for row in rows], dtype=bool)
+        self.volumes = np.array([row[4] or 0 for row in rows], dtype=np.float64)
+        self._positions = {item_id: position for position, item_id in enumerate(self.ids.tolist())}
+        self.loaded = time.monotonic()
+        self.price_version = None
+
+    def _load_prices(self, prices: dict) -> None:
+        self.low = np.zeros(len(self.ids))
+        self.high = np.zeros(len(self.ids))
+
+        for item_id, latest in prices.items():
+            position = self._positions.get(item_id)
+            if position is not None:
+                self.low[position] = latest.low_price
+                self.high[position] = latest.high_price
+
+        self.price_version = self.prices.version
+
+    async def refresh(self) -> None:
+        prices = await self.prices.get_prices()
+
+        async with self._lock:
+            if time.monotonic() - self.loaded > self.max_age:
+                await self._load_items()
+            if self.price_version != self.prices.version:
+                self._load_prices(prices)
+
+    async def scan(self, limit: int = 100, members: bool | None = None, min_roi: float | None = None,
+                   min_volume: float | None = None, max_price: int | None = None, min_margin: int | None = None,
+                   sort: str = 'profit') -> list[dict]:
+        await self.refresh()
+        low, high = self.low, self.high
+
+        tax = ge_tax(high)
+        margin = high - low - tax
+        with np.errstate(divide='ignore', invalid='ignore'):
+            roi = np.where(low > 0, margin / low, 0.0)
+            # Share of a full buy limit the recent volume could fill, items without a limit only depend on volume
+            liquidity = np.where(self.limits > 0, np.minimum(self.volumes / self.limits, 1.0), self.volumes > 0)
+        quantity = np.where(self.limits > 0, np.minimum(self.limits, self.volumes), self.volumes)
+        profit = margin * quantity
+
+        mask = (low > 0) & (high > 0)
+        if members is not None:
+            mask &= self.members == members
+        if min_roi is not None:
+            mask &= roi >= min_roi
+        if min_volume is not None:
+            mask &= self.volumes >= min_volume
+        if max_price is not None:
+            mask &= low <= max_price
+        if min_margin is not None:
+            mask &= margin >= min_margin
+
+        columns = {'profit': profit, 'roi': roi, 'margin': margin, 'volume': self.volumes, 'liquidity': liquidity}
+        candidates = np.flatnonzero(mask)
+        score = columns[sort][candidates]
+
+        # Partial selection of the top N before sorting only those, ties rank by item id including at the cut
+        if len(candidates) > limit:
+            cut = -np.partition(-score, limit - 1)[limit - 1]
+            above = np.flatnonzero(score > cut)
+            top = np.concatenate((above, np.flatnonzero(score == cut)[:limit - len(above)]))
+            top.sort()
+            candidates, score = candidates[top], score[top]
+        candidates = candidates[np.argsort(-score, kind='stable')]
+
+        return [{'item_id': int(self.ids[i]), 'name': self.names[i], 'low_price': int(low[i]),
+                 'high_price': int(high[i]), 'tax': int(tax[i]), 'margin': int(margin[i]), 'roi': float(roi[i]),
+                 'volume': int(self.volumes[i]), 'limit': int(self.limits[i]), 'profit': int(profit[i]),
+                 'liquidity': float(liquidity[i])} for i in candidates]
+
+
+flip_scanner = FlipScanner(latest_cache)
@@ -0,0 +1,191 @@
+import asyncio
+import math
+import os
+from collections import deque
+from datetime import datetime
+
+import numpy as np
+from sqlalchemy import select
+
+from . import models, schemas
+from .database import async_session
+
+# Lookbacks in Average buckets, every window gets its own SMA, EMA, volatility and VWAP
+INDICATOR_WINDOWS = tuple(int(window) for window in os.environ.get('INDICATOR_WINDOWS', '12,26,50').split(','))
+
+# Buckets loaded when an item is first requested, enough for the EMA seed to have decayed below rounding
+INDICATOR_HISTORY = int(os.environ.get('INDICATOR_HISTORY', 500))
+
+
+def mid_prices(low: np.ndarray, high: np.ndarray) -> np.ndarray:
+    # Twice the mid price so sums stay exact integers, one sided buckets use the side that traded
+    return np.where((low > 0) & (high > 0), low + high, 2 * np.maximum(low, high))
+
+
+class Window:
+    __slots__ = ('size', 'alpha', 'prices', 'price_sum', 'returns', 'return_sum', 'return_squares', 'values',
+                 'volumes', 'value_sum', 'volume_sum', 'ema')
+
+    def __init__(self, size: int, prices: np.ndarray, returns: np.ndarray, values: np.ndarray, volumes: np.ndarray):
+        # Seeded from the tail of the series, EMA over all of it weighted in one dot product
+        self.size = size
+        self.alpha = 2 / (size + 1)
+        self.prices = deque(prices[-size:].tolist())
+        self.price_sum = sum(self.prices)
+        self.returns = deque(returns[-size:].tolist())
+        self.return_sum = math.fsum(self.returns)
+        self.return_squares = math.fsum(value * value for value in self.returns)
+        self.values = deque(values[-size:].tolist())
+        self.volumes = deque(volumes[-size:].tolist())
+        self.value_sum = sum(self.values)
+        self.volume_sum = sum(self.volumes)
+
+        decay = (1 - self.alpha) ** np.arange(len(prices) - 1, -1, -1)
+        decay[1:] *= self.alpha
+        self.ema = float(decay @ prices) / 2 if len(prices) else None
+
+    def update(self, price: int, change: float | None, value: int, volume: int) -> None:
+        self.prices.append(price)
+        self.price_sum += price
+        if len(self.prices) > self.size:
+            self.price_sum -= self.prices.popleft()
+
+        if change is not None:
+            self.returns.append(change)
+            self.return_sum += change
+            self.return_squares += change * change
+            if len(self.returns) > self.size:
+                dropped = self.returns.popleft()
+                self.return_sum -= dropped
+                self.return_squares -= dropped * dropped
+
+        self.values.append(value)
+        self.volumes.append(volume)
+        self.value_sum += value
+        self.volume_sum += volume
+        if len(self.values) > self.size:
+            self.value_sum -= self.values.popleft()
+            self.volume_sum -= self.volumes.popleft()
+
+        self.ema = price / 2 if self.ema is None else self.ema + self.alpha * (price / 2 - self.ema)
+
+    def snapshot(self) -> dict:
+        count = len(self.returns)
+        variance = None
+        if count > 1:
+            variance = (self.return_squares - self.return_sum * self.return_sum / count) / (count - 1)
+        return {'window': self.size, 'bars': len(self.prices),
+                'sma': self.price_sum / len(self.prices) / 2 if self.prices else None, 'ema': self.ema,
+                'volatility': math.sqrt(max(variance, 0.0)) if variance is not None else None,
+                'vwap': self.value_sum / self.volume_sum if self.volume_sum else None}
+
+
+class ItemIndicators:
+    """Indicator state of one item, built vectorized from its Average series and advanced in O(1) per bucket."""
+
+    __slots__ = ('item_id', 'time_stamp', 'price', 'windows')
+
+    def __init__(self, item_id: int, stamps: list[datetime], low: np.ndarray, high: np.ndarray,
+                 low_volume: np.ndarray, high_volume: np.ndarray, windows: tuple[int, ...] = INDICATOR_WINDOWS):
+        prices = mid_prices(low, high)
+        traded = prices > 0
+        prices = prices[traded]
+        returns = np.diff(np.log(prices))
+        values = (low * low_volume + high * high_volume)[traded]
+        volumes = (low_volume + high_volume)[traded]
+
+        self.item_id = item_id
+        self.time_stamp = stamps[-1] if stamps else None
+        self.price = int(prices[-1]) if len(prices) else None
+        self.windows = [Window(size, prices, returns, values, volumes) for size in windows]
+
+    def update(self, time_stamp: datetime, low: int, high: int, low_volume: int, high_volume: int) -> None:
+        self.time_stamp = time_stamp
+        price = low + high if low > 0 and high > 0 else 2 * max(low, high)
+        if price <= 0:
+            return
+
+        change = math.log(price / self.price) if self.price is not None else None
+        self.price = price
+        for window in self.windows:
+            window.update(price, change, low * low_volume + high * high_volume, low_volume + high_volume)
+
+    def snapshot(self) -> dict:
+        return {'item_id': self.item_id, 'time_stamp': self.time_stamp,
+                'price': self.price / 2 if self.price is not None else None,
+                'windows': [window.snapshot() for window in self.windows]}
+
+
+class IndicatorEngine:
+    """Indicators for the items that have been asked for, kept current from the average ingest paths."""
+
+    def __init__(self, windows: tuple[int, ...] = INDICATOR_WINDOWS, history: int = INDICATOR_HISTORY):
+        self.windows = windows
+        self.history = max(history, max(windows) + 1)
+        self.items: dict[int, ItemIndicators] = {}
+        # Rows ingested while an item is being loaded, replayed once its state is in place
+        self._pending: dict[int, list] = {}
+        self.loads = 0
+        self.updates = 0
+        self.invalidations = 0
+        # One load per item in flight, readers of the same item share it and other items load concurrently
+        self._loading: dict[int, asyncio.Future] = {}
+
+    async def _load(self, item_id: int) -> ItemIndicators | None:
+        self._pending[item_id] = []
+        try:
+            average = models.Average
+            stmt = select(average.time_stamp, average.low_price, average.high_price, average.low_volume,
+                          average.high_volume).where(average.item_id == item_id).order_by(
+                average.time_stamp.desc()).limit(self.history)
+            async with async_session() as session:
+                rows = (await session.execute(stmt)).all()[::-1]
+        finally:
+            pending = self._pending.pop(item_id)
+        if not rows:
+            return None
+
+        columns = [np.array([row[index] for row in rows], dtype=np.int64) for index in range(1, 5)]
+        state = ItemIndicators(item_id, [row[0] for row in rows], *columns, windows=self.windows)
+        for row in sorted(pending, key=lambda row: row[0]):
+            if row[0] > state.time_stamp:
+                state.update(*row)
+        self.items[item_id] = state
+        self.loads += 1
+        return state
+
+    async def get(self, item_id: int) -> dict | None:
+        state = self.items.get(item_id)
+        if state is None:
+            loading = self._loading.get(item_id)
+            if loading is None:
+                loading = self._loading[item_id] = asyncio.ensure_future(self._load(item_id))
+                loading.add_done_callback(lambda _: self._loading.pop(item_id, None))
+            # A reader going away does not cancel the load the others are waiting on
+            state = await asyncio.shield(loading)
+        return state.snapshot() if state is not None else None
+
+    def ingest(self, rows: list[schemas.PriceRow]) -> None:
+        # Items nobody asked for are skipped
+        for row in rows:
+            entry = (row.time_stamp, row.low_price, row.high_price, row.low_volume, row.high_volume)
+            state = self.items.get(row.item_id)
+            if state is None:
+                if row.item_id in self._pending:
+                    self._pending[row.item_id].append(entry)
+                continue
+
+            # A rewritten or late bucket cannot be applied incrementally, the item is rebuilt on its next read
+            if entry[0] <= state.time_stamp:
+                del self.items[row.item_id]
+                self.invalidations += 1
+                continue
+            state.update(*entry)
+            self.updates += 1
+
+    def stats(self) -> dict:
+        return {'items': len(self.items), 'loads': self.loads, 'updates': self.updates,
+                'invalidations': self.invalidations}
+
+
+indicator_engine = IndicatorEngine()
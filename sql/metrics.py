@@ -0,0 +1,179 @@
+import asyncio
+import time
+from contextvars import Context, ContextVar
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from .database import Base
+
+# Upper bounds in seconds of the request latency histogram buckets
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class RouteStats:
+    __slots__ = ('buckets', 'count', 'seconds', 'statements', 'sql_seconds', 'rows', 'checkouts', 'pool_wait')
+
+    def __init__(self):
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+        self.count = 0
+        self.seconds = 0.0
+        self.statements = 0
+        self.sql_seconds = 0.0
+        self.rows = 0
+        self.checkouts = 0
+        self.pool_wait = 0.0
+
+    def observe(self, seconds: float) -> None:
+        self.count += 1
+        self.seconds += seconds
+        for index, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                self.buckets[index] += 1
+                break
+
+
+# Stats of the request currently being served, database hooks add to it from the same task
+_current: ContextVar[RouteStats | None] = ContextVar('metrics_route_stats', default=None)
+
+routes: dict[str, RouteStats] = {}
+background = RouteStats()
+
+
+def _stats() -> RouteStats:
+    stats = _current.get()
+    return stats if stats is not None else background
+
+
+def background_task(coro) -> asyncio.Task:
+    # Tasks copy the context they are created in, one started while serving a request would charge it all its work
+    return asyncio.create_task(coro, context=Context())
+
+
+def rows_loaded(count: int) -> None:
+    # For reads that return plain column tuples, which the ORM load event never sees
+    _stats().rows += count
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware timing every request, labelled by method and route template."""
+
+    def __init__(self, app):
+        self.app = app
+        self._templates: dict = {}
+
+    def _route(self, scope) -> str:
+        endpoint = scope.get('endpoint')
+        if endpoint is None:
+            return f"{scope['method']} unmatched"
+
+        template = self._templates.get(endpoint)
+        if template is None:
+            matches = (route.path for route in scope['app'].routes if getattr(route, 'endpoint', None) is endpoint)
+            template = next(matches, endpoint.__name__)
+            self._templates[endpoint] = template
+        return f"{scope['method']} {template}"
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        stats = RouteStats()
+        token = _current.set(stats)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            elapsed = time.perf_counter() - started
+            _current.reset(token)
+
+            # The router records the matched endpoint in the shared scope
+            route = routes.setdefault(self._route(scope), RouteStats())
+            route.observe(elapsed)
+            route.statements += stats.statements
+            route.sql_seconds += stats.sql_seconds
+            route.rows += stats.rows
+            route.checkouts += stats.checkouts
+            route.pool_wait += stats.pool_wait
+
+
+def instrument_engine(engine: AsyncEngine) -> None:
+    sync_engine = engine.sync_engine
+
+    @event.listens_for(sync_engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('metrics_started', []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        stats = _stats()
+        stats.statements += 1
+        stats.sql_seconds += time.perf_counter() - conn.info['metrics_started'].pop()
+
+    @event.listens_for(Base, 'load', propagate=True)
+    def load(target, context):
+        _stats().rows += 1
+
+    # Time spent waiting on pool.connect() covers queueing for a free connection and opening new ones
+    pool = sync_engine.pool
+    connect = pool.connect
+
+    def timed_connect():
+        started = time.perf_counter()
+        try:
+            return connect()
+        finally:
+            stats = _stats()
+            stats.checkouts += 1
+            stats.pool_wait += time.perf_counter() - started
+
+    pool.connect = timed_connect
+
+
+def pool_gauges(engine: AsyncEngine) -> dict[str, float]:
+    # Only queue pools track saturation, NullPool (the SQLite default) opens a connection per checkout
+    pool = engine.sync_engine.pool
+    if not hasattr(pool, 'checkedout'):
+        return {}
+    return {'flipper_pool_size': pool.size(), 'flipper_pool_checked_out': pool.checkedout(),
+            'flipper_pool_overflow': pool.overflow()}
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(**labels) -> str:
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + '}'
+
+
+def render(counters: dict[str, float] | None = None, gauges: dict[str, float] | None = None) -> str:
+    # Counters are only formatted here, so the cost of instrumentation stays on the scrape path
+    lines = ['# HELP flipper_http_request_duration_seconds Request latency by route',
+             '# TYPE flipper_http_request_duration_seconds histogram']
+    for route, stats in sorted(routes.items()):
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS, stats.buckets):
+            cumulative += count
+            lines.append(f'flipper_http_request_duration_seconds_bucket{_labels(route=route, le=bound)} {cumulative}')
+        lines.append(f'flipper_http_request_duration_seconds_bucket{_labels(route=route, le="+Inf")} {stats.count}')
+        lines.append(f'flipper_http_request_duration_seconds_sum{_labels(route=route)} {stats.seconds}')
+        lines.append(f'flipper_http_request_duration_seconds_count{_labels(route=route)} {stats.count}')
+
+    route_counters = (
+        ('flipper_sql_statements_total', 'SQL statements executed', 'statements'),
+        ('flipper_sql_duration_seconds_total', 'Time spent executing SQL', 'sql_seconds'),
+        ('flipper_db_rows_loaded_total', 'Rows loaded from the database', 'rows'),
+        ('flipper_pool_checkouts_total', 'Connections checked out of the pool', 'checkouts'),
+        ('flipper_pool_wait_seconds_total', 'Time spent waiting for a pooled connection', 'pool_wait'),
+    )
+    for name, description, attribute in route_counters:
+        lines += [f'# HELP {name} {description}', f'# TYPE {name} counter']
+        for route, stats in [*sorted(routes.items()), ('background', background)]:
+            lines.append(f'{name}{_labels(route=route)} {getattr(stats, attribute)}')
+
+    for kind, values in (('counter', counters), ('gauge', gauges)):
+        for name, value in (values or {}).items():
+            lines += [f'# TYPE {name} {kind}', f'{name} {value}']
+
+    return '\n'.join(lines) + '\n'
@@ -1,6 +1,7 @@
 import datetime
 
-from sqlalchemy import Column, Integer, String, ForeignKey, Boolean, DateTime, Float, Date, UniqueConstraint
+from sqlalchemy import (BigInteger, Column, Integer, String, ForeignKey, Boolean, DateTime, Float, Date, Index,
+                        UniqueConstraint)
 from sqlalchemy.orm import relationship
 from .database import Base
 
@@ -11,9 +12,9 @@ class Items(Base):
     id = Column(Integer, primary_key=True, autoincrement=False)
     name = Column(String(100), unique=True)
     market = Column(Integer)
-    limit = Column(Integer)
-    members = Column(Boolean)
-    high_alch = Column(Integer)
+    limit = Column(Integer, index=True)
+    members = Column(Boolean, index=True)
+    high_alch = Column(Integer, index=True)
     low_alch = Column(Integer)
     created = Column(DateTime, nullable=False, default=datetime.datetime.utcnow())
     updated = Column(DateTime, nullable=False, default=datetime.datetime.utcnow(), onupdate=datetime.datetime.utcnow())
@@ -24,6 +25,8 @@ class Items(Base):
     daily = relationship("Daily", back_populates='item', cascade="all, delete, delete-orphan")
     production = relationship("Production", back_populates='item', cascade="all, delete, delete-orphan")
     materials = relationship("Material", back_populates='item')
+    candles = relationship("Candle", back_populates='item', cascade="all, delete, delete-orphan")
+    alert_rules = relationship("AlertRule", back_populates='item', cascade="all, delete, delete-orphan")
 
     # indices = relationship("TradeIndex", back_populates='item')
 
@@ -35,6 +38,8 @@ class Items(Base):
 
 class Category(Base):
     __tablename__ = "category"
+    # Category filters resolve name to item ids from the index alone
+    __table_args__ = (Index('ix_category_name_item_id', 'name', 'item_id'),)
 
     id = Column(Integer, primary_key=True)
     item_id = Column(Integer, ForeignKey('items.id'))
@@ -58,7 +63,7 @@ class Latest(Base):
     item_id = Column(Integer, ForeignKey('items.id'))
     low_price = Column(Integer, nullable=False)
     high_price = Column(Integer, nullable=False)
-    time_stamp = Column(DateTime, nullable=False)
+    time_stamp = Column(DateTime, nullable=False, index=True)
     created = Column(DateTime, nullable=False, default=datetime.datetime.utcnow())
     updated = Column(DateTime, nullable=False, default=datetime.datetime.utcnow(), onupdate=datetime.datetime.utcnow())
 
@@ -81,7 +86,8 @@ class Average(Base):
     high_price = Column(Integer, nullable=False)
     low_volume = Column(Integer, nullable=False)
     high_volume = Column(Integer, nullable=False)
-    time_stamp = Column(DateTime, nullable=False)
+    # Daily aggregation reads whole days across every item
+    time_stamp = Column(DateTime, nullable=False, index=True)
     created = Column(DateTime, nullable=False, default=datetime.datetime.utcnow())
     updated = Column(DateTime, nullable=False, default=datetime.datetime.utcnow(), onupdate=datetime.datetime.utcnow())
 
@@ -114,6 +120,57 @@ class Daily(Base):
         return f"Daily(id={self.id}, date={self.date_stamp}, item={self.item_id}, price={self.price}, volume={self.volume})"
 
 
+class Candle(Base):
+    __tablename__ = "candle"
+    __table_args__ = (UniqueConstraint('item_id', 'interval', 'time_stamp'),
+                      Index('ix_candle_interval_time_stamp', 'interval', 'time_stamp'))
+
+    id = Column(Integer, primary_key=True)
+    item_id = Column(Integer, ForeignKey('items.id'))
+    interval = Column(String(3), nullable=False)
+    time_stamp = Column(DateTime, nullable=False)
+    low_open = Column(Integer, nullable=False)
+    low_high = Column(Integer, nullable=False)
+    low_low = Column(Integer, nullable=False)
+    low_close = Column(Integer, nullable=False)
+    high_open = Column(Integer, nullable=False)
+    high_high = Column(Integer, nullable=False)
+    high_low = Column(Integer, nullable=False)
+    high_close = Column(Integer, nullable=False)
+    ticks = Column(Integer, nullable=False)
+    created = Column(DateTime, nullable=False, default=datetime.datetime.utcnow())
+    updated = Column(DateTime, nullable=False, default=datetime.datetime.utcnow(), onupdate=datetime.datetime.utcnow())
+
+    item = relationship('Items', back_populates='candles')
+
+    __mapper_args__ = {"eager_defaults": True}
+
+    def __repr__(self):
+        return f"Candle(id={self.id}, interval={self.interval}, time={self.time_stamp}, item={self.item_id})"
+
+
+class Watermark(Base):
+    __tablename__ = "watermark"
+
+    name = Column(String(50), primary_key=True)
+    time_stamp = Column(DateTime, nullable=False)
+    updated = Column(DateTime, nullable=False, default=datetime.datetime.utcnow(), onupdate=datetime.datetime.utcnow())
+
+    def __repr__(self):
+        return f"Watermark(name={self.name}, time={self.time_stamp})"
+
+
+class DataVersion(Base):
+    __tablename__ = "data_version"
+
+    name = Column(String(50), primary_key=True)
+    sequence = Column(BigInteger, nullable=False)
+    modified = Column(DateTime, nullable=False)
+
+    def __repr__(self):
+        return f"DataVersion(name={self.name}, sequence={self.sequence})"
+
+
 class Production(Base):
     __tablename__ = "production"
 
@@ -177,3 +234,41 @@ class Skill(Base):
     def __repr__(self):
         return f"Skill(id={self.id}, name={self.name}, level={self.level}, experience={self.experience}, " \
                f"production_id={self.production_id})"
+
+
+class AlertRule(Base):
+    __tablename__ = "alert_rule"
+
+    id = Column(Integer, primary_key=True)
+    item_id = Column(Integer, ForeignKey('items.id'), index=True)
+    source = Column(String(10), nullable=False)
+    field = Column(String(20), nullable=False)
+    op = Column(String(2), nullable=False)
+    threshold = Column(Integer, nullable=False)
+    created = Column(DateTime, nullable=False, default=datetime.datetime.utcnow())
+    updated = Column(DateTime, nullable=False, default=datetime.datetime.utcnow(), onupdate=datetime.datetime.utcnow())
+
+    item = relationship('Items', back_populates='alert_rules')
+    triggers = relationship('AlertTrigger', back_populates='rule', cascade="all, delete, delete-orphan")
+
+    __mapper_args__ = {"eager_defaults": True}
+
+    def __repr__(self):
+        return f"AlertRule(id={self.id}, item={self.item_id}, {self.source}.{self.field} {self.op} {self.threshold})"
+
+
+class AlertTrigger(Base):
+    __tablename__ = "alert_trigger"
+    __table_args__ = (Index('ix_alert_trigger_rule_id_time_stamp', 'rule_id', 'time_stamp'),)
+
+    id = Column(Integer, primary_key=True)
+    rule_id = Column(Integer, ForeignKey('alert_rule.id'))
+    item_id = Column(Integer, nullable=False)
+    price = Column(Integer, nullable=False)
+    time_stamp = Column(DateTime, nullable=False)
+    created = Column(DateTime, nullable=False, default=datetime.datetime.utcnow())
+
+    rule = relationship('AlertRule', back_populates='triggers')
+
+    def __repr__(self):
+        return f"AlertTrigger(id={self.id}, rule={self.rule_id}, price={self.price}, time={self.time_stamp})"
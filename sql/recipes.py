@@ -0,0 +1,137 @@
+import asyncio
+import math
+import os
+import time
+
+from sqlalchemy import select
+from sqlalchemy.orm import selectinload
+
+from . import models
+from .cache import PriceCache, latest_cache
+from .database import async_session
+from .flips import ge_tax
+
+# One game tick is 0.6 seconds
+TICKS_PER_HOUR = 6000
+
+# Seconds between reloads of the recipe tables, priced results follow the price cache directly
+RECIPE_TTL = float(os.environ.get('RECIPE_TTL', 300))
+
+SORT_KEYS = ('profit', 'profit_per_tick', 'profit_per_hour')
+
+
+class RecipeEngine:
+    """Prices every Production recipe, costing each material as the cheaper of buying it or crafting it."""
+
+    def __init__(self, prices: PriceCache, max_age: float = RECIPE_TTL):
+        self.prices = prices
+        self.max_age = max_age
+        self.loaded = 0.0
+        self.recipes: list[models.Production] = []
+        self.recipes_by_item: dict[int, list[models.Production]] = {}
+        self.item_ids: dict[str, int] = {}
+        self.item_names: dict[int, str] = {}
+        self.price_version = None
+        self.results: list[dict] = []
+        self._lock = asyncio.Lock()
+
+    async def _load_recipes(self) -> None:
+        stmt = select(models.Production).options(selectinload(models.Production.materials))
+
+        async with async_session() as session:
+            self.recipes = (await session.execute(stmt)).scalars().all()
+            items = (await session.execute(select(models.Items.id, models.Items.name))).all()
+
+        self.item_ids = {name: item_id for item_id, name in items}
+        self.item_names = {item_id: name for item_id, name in items}
+        self.recipes_by_item = {}
+        for recipe in self.recipes:
+            self.recipes_by_item.setdefault(recipe.item_id, []).append(recipe)
+
+        self.loaded = time.monotonic()
+        self.price_version = None
+
+    def _price(self, prices: dict, item_id: int | None, field: str) -> float:
+        latest = prices.get(item_id)
+        return getattr(latest, field) if latest is not None else math.inf
+
+    def _craft_cost(self, prices: dict, recipe: models.Production, memo: dict,
+                    visiting: set) -> tuple[float, frozenset]:
+        cost = recipe.cost
+        cuts = frozenset()
+        for material in recipe.materials:
+            unit_cost, _, material_cuts = self._unit_cost(prices, self.item_ids.get(material.name), memo, visiting)
+            cost += material.quantity * unit_cost
+            cuts |= material_cuts
+        return cost, cuts
+
+    def _unit_cost(self, prices: dict, item_id: int | None, memo: dict,
+                   visiting: set) -> tuple[float, str, frozenset]:
+        # An item already on the current path can only be bought there. The items cut that way are passed up, a cost
+        # that depended on one is only right for this path and is memoized once the cut item itself is resolved
+        if item_id in memo:
+            return memo[item_id]
+        if item_id is None:
+            return self._price(prices, item_id, 'high_price'), 'buy', frozenset()
+        if item_id in visiting:
+            return self._price(prices, item_id, 'high_price'), 'buy', frozenset((item_id,))
+
+        visiting.add(item_id)
+        best = self._price(prices, item_id, 'high_price'), 'buy'
+        cuts = frozenset()
+        for recipe in self.recipes_by_item.get(item_id, []):
+            if recipe.quantity <= 0:
+                continue
+            crafted, recipe_cuts = self._craft_cost(prices, recipe, memo, visiting)
+            cuts |= recipe_cuts
+            if crafted / recipe.quantity < best[0]:
+                best = crafted / recipe.quantity, 'craft'
+        visiting.discard(item_id)
+
+        result = *best, cuts - {item_id}
+        if not result[2]:
+            memo[item_id] = result
+        return result
+
+    def _price_recipes(self, prices: dict) -> list[dict]:
+        memo = {}
+        results = []
+
+        for recipe in self.recipes:
+            sell = self._price(prices, recipe.item_id, 'low_price')
+            materials = []
+            for material in recipe.materials:
+                unit_cost, source, _ = self._unit_cost(prices, self.item_ids.get(material.name), memo, set())
+                materials.append({'name': material.name, 'quantity': material.quantity, 'unit_cost': unit_cost,
+                                  'source': source})
+
+            cost = recipe.cost + sum(material['quantity'] * material['unit_cost'] for material in materials)
+            if math.isinf(sell) or math.isinf(cost):
+                continue
+
+            revenue = recipe.quantity * (sell - int(ge_tax(sell)))
+            profit = revenue - cost
+            ticks = max(recipe.ticks, 1)
+            results.append({
+                'production_id': recipe.id, 'item_id': recipe.item_id, 'name': self.item_names.get(recipe.item_id),
+                'quantity': recipe.quantity, 'ticks': recipe.ticks, 'revenue': revenue, 'cost': cost,
+                'profit': profit, 'profit_per_tick': profit / ticks, 'profit_per_hour': profit * TICKS_PER_HOUR / ticks,
+                'materials': materials,
+            })
+
+        return results
+
+    async def rank(self, limit: int = 100, sort: str = 'profit_per_hour') -> list[dict]:
+        prices = await self.prices.get_prices()
+
+        async with self._lock:
+            if time.monotonic() - self.loaded > self.max_age:
+                await self._load_recipes()
+            if self.price_version != self.prices.version:
+                self.results = self._price_recipes(prices)
+                self.price_version = self.prices.version
+
+        return sorted(self.results, key=lambda result: result[sort], reverse=True)[:limit]
+
+
+recipe_engine = RecipeEngine(latest_cache)
@@ -0,0 +1,86 @@
+import argparse
+import asyncio
+import os
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, exists, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import crud, models, rollup
+from .database import async_session
+
+# Days of raw history kept per table, rows are only removed once their rollup exists
+RETENTION = {
+    'latest': timedelta(days=float(os.environ.get('RETENTION_LATEST_DAYS', 7))),
+    'average': timedelta(days=float(os.environ.get('RETENTION_AVERAGE_DAYS', 90))),
+}
+
+# Rows removed per DELETE statement and transaction
+RETENTION_BATCH_SIZE = int(os.environ.get('RETENTION_BATCH_SIZE', 5000))
+
+
+async def _criteria(db: AsyncSession, table: str, now: datetime) -> tuple | None:
+    cutoff = now - RETENTION[table]
+
+    if table == 'latest':
+        # Ticks are covered by 5m candles up to the rollup watermark
+        mark = await rollup.get_watermark(db, rollup.watermark_name('5m'))
+        if mark is None:
+            return None
+        return models.Latest.time_stamp < min(cutoff, mark),
+
+    # Average buckets are covered once the Daily row for their item and day exists
+    covered = exists().where(models.Daily.item_id == models.Average.item_id,
+                             models.Daily.date_stamp == func.date(models.Average.time_stamp))
+    return models.Average.time_stamp < cutoff, covered
+
+
+async def purge(db: AsyncSession, table: str, now: datetime | None = None,
+                batch_size: int = RETENTION_BATCH_SIZE) -> dict:
+    model = {'latest': models.Latest, 'average': models.Average}[table]
+    started = time.perf_counter()
+    deleted = 0
+
+    criteria = await _criteria(db, table, now or datetime.utcnow())
+    item_ids = []
+    if criteria is not None:
+        # Only items with something to delete, each found by one probe of the unique (item_id, time_stamp) index
+        expired = exists().where(model.item_id == models.Items.id, *criteria)
+        item_ids = (await db.execute(select(models.Items.id).where(expired))).scalars().all()
+
+    # Walk the index one item at a time instead of scanning by time_stamp
+    for item_id in item_ids:
+        while True:
+            batch = select(model.id).where(model.item_id == item_id, *criteria).limit(batch_size)
+            stmt = delete(model).where(model.id.in_(batch)).execution_options(synchronize_session=False)
+            result = await db.execute(stmt)
+            if result.rowcount:
+                await crud.bump_data_version(db, table)
+            await db.commit()
+
+            deleted += result.rowcount
+            if result.rowcount < batch_size:
+                break
+
+    return {'table': table, 'deleted': deleted, 'items': len(item_ids), 'seconds': time.perf_counter() - started}
+
+
+async def main():
+    parser = argparse.ArgumentParser(description='Delete raw price history past its retention period')
+    parser.add_argument('tables', nargs='*', help=f"tables to purge, any of {', '.join(RETENTION)} (default all)")
+    args = parser.parse_args()
+
+    unknown = set(args.tables) - set(RETENTION)
+    if unknown:
+        parser.error(f"unknown tables: {', '.join(sorted(unknown))}")
+
+    async with async_session() as session:
+        for table in args.tables or RETENTION:
+            result = await purge(session, table)
+            print(f"{result['table']}: {result['deleted']} rows of {result['items']} items deleted in "
+                  f"{result['seconds']:.2f}s")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,153 @@
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import crud, models
+from .database import async_session
+
+logger = logging.getLogger(__name__)
+
+EPOCH = datetime(1970, 1, 1)
+
+# Each interval is built from the one before it, 5m candles from raw Latest ticks
+INTERVALS = {'5m': timedelta(minutes=5), '1h': timedelta(hours=1), '1d': timedelta(days=1)}
+SOURCES = {'5m': None, '1h': '5m', '1d': '1h'}
+
+# Source rows read per pass, bounds memory when catching up on a large backlog
+CHUNKS = {'5m': timedelta(hours=1), '1h': timedelta(hours=12), '1d': timedelta(days=7)}
+
+# Ticks may arrive shortly after their bucket closes, wait this long before sealing a bucket
+ROLLUP_DELAY = timedelta(seconds=float(os.environ.get('ROLLUP_DELAY', 60)))
+
+# Seconds between rollup passes when the API runs them in the background, 0 leaves it to `python -m sql.rollup`
+ROLLUP_PERIOD = float(os.environ.get('ROLLUP_PERIOD', 0))
+
+CANDLE_COLUMNS = ('low_open', 'low_high', 'low_low', 'low_close', 'high_open', 'high_high', 'high_low', 'high_close',
+                  'ticks')
+
+
+def floor_time(dt: datetime, step: timedelta) -> datetime:
+    return EPOCH + (dt - EPOCH) // step * step
+
+
+def watermark_name(interval: str) -> str:
+    return f'candle_{interval}'
+
+
+async def get_watermark(db: AsyncSession, name: str) -> datetime | None:
+    result = await db.get(models.Watermark, name)
+    return result.time_stamp if result is not None else None
+
+
+def _merge(candles: dict, key: tuple, values: tuple) -> None:
+    # values are ordered like CANDLE_COLUMNS and sorted by time within an item
+    candle = candles.get(key)
+    if candle is None:
+        candles[key] = list(values)
+        return
+
+    candle[1] = max(candle[1], values[1])
+    candle[2] = min(candle[2], values[2])
+    candle[3] = values[3]
+    candle[5] = max(candle[5], values[5])
+    candle[6] = min(candle[6], values[6])
+    candle[7] = values[7]
+    candle[8] += values[8]
+
+
+async def _source_rows(db: AsyncSession, interval: str, start: datetime, end: datetime):
+    source = SOURCES[interval]
+
+    if source is None:
+        stmt = select(models.Latest.item_id, models.Latest.time_stamp, models.Latest.low_price,
+                      models.Latest.high_price).where(models.Latest.time_stamp >= start, models.Latest.time_stamp < end)
+        result = await db.execute(stmt.order_by(models.Latest.item_id, models.Latest.time_stamp))
+        for item_id, time_stamp, low, high in result:
+            yield item_id, time_stamp, (low, low, low, low, high, high, high, high, 1)
+        return
+
+    columns = [getattr(models.Candle, column) for column in CANDLE_COLUMNS]
+    stmt = select(models.Candle.item_id, models.Candle.time_stamp, *columns).where(
+        models.Candle.interval == source, models.Candle.time_stamp >= start, models.Candle.time_stamp < end)
+    result = await db.execute(stmt.order_by(models.Candle.item_id, models.Candle.time_stamp))
+    for item_id, time_stamp, *values in result:
+        yield item_id, time_stamp, tuple(values)
+
+
+async def _first_source_time(db: AsyncSession, interval: str) -> datetime | None:
+    source = SOURCES[interval]
+    if source is None:
+        stmt = select(func.min(models.Latest.time_stamp))
+    else:
+        stmt = select(func.min(models.Candle.time_stamp)).where(models.Candle.interval == source)
+    return (await db.execute(stmt)).scalar()
+
+
+async def rollup_interval(db: AsyncSession, interval: str, now: datetime | None = None) -> int:
+    step = INTERVALS[interval]
+    source = SOURCES[interval]
+    now = now or datetime.utcnow()
+
+    start = await get_watermark(db, watermark_name(interval))
+    if start is None:
+        first = await _first_source_time(db, interval)
+        if first is None:
+            return 0
+        start = floor_time(first, step)
+
+    # Only buckets whose source data is complete are sealed
+    end = floor_time(now - ROLLUP_DELAY, step)
+    if source is not None:
+        source_mark = await get_watermark(db, watermark_name(source))
+        end = min(end, floor_time(source_mark, step)) if source_mark is not None else start
+
+    written = 0
+    while start < end:
+        chunk_end = min(start + CHUNKS[interval], end)
+
+        candles = {}
+        async for item_id, time_stamp, values in _source_rows(db, interval, start, chunk_end):
+            _merge(candles, (item_id, floor_time(time_stamp, step)), values)
+
+        rows = [{'item_id': item_id, 'interval': interval, 'time_stamp': time_stamp,
+                 **dict(zip(CANDLE_COLUMNS, values))} for (item_id, time_stamp), values in candles.items()]
+
+        # The watermark is committed in the same transaction as the candles it covers
+        await db.merge(models.Watermark(name=watermark_name(interval), time_stamp=chunk_end))
+        result = await crud.bulk_upsert(db, models.Candle, rows, ('item_id', 'interval', 'time_stamp'))
+
+        written += result.inserted + result.updated
+        start = chunk_end
+
+    return written
+
+
+async def rollup(db: AsyncSession, now: datetime | None = None) -> dict[str, int]:
+    return {interval: await rollup_interval(db, interval, now=now) for interval in INTERVALS}
+
+
+async def run_periodically(period: float = ROLLUP_PERIOD):
+    while True:
+        try:
+            async with async_session() as session:
+                await rollup(session)
+        except Exception:
+            # Keep the loop alive, the next pass resumes from the committed watermarks
+            logger.exception('Candle rollup failed')
+        await asyncio.sleep(period)
+
+
+async def main():
+    async with async_session() as session:
+        written = await rollup(session)
+
+    for interval, count in written.items():
+        print(f'{interval}: {count} candles written')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
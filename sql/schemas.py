@@ -1,6 +1,24 @@
+from typing import Generic, Literal, NamedTuple, TypeVar
+
 from pydantic import BaseModel
+from pydantic.generics import GenericModel
 from datetime import datetime, date
 
+T = TypeVar('T')
+
+
+class Page(GenericModel, Generic[T]):
+    data: list[T]
+    next_cursor: str | None
+
+
+class BulkResult(BaseModel):
+    received: int = 0
+    inserted: int = 0
+    updated: int = 0
+    skipped: int = 0
+    batches: int = 0
+
 
 class CategoryBase(BaseModel):
     name: str
@@ -40,6 +58,11 @@ class Latest(LatestBase):
         orm_mode = True
 
 
+class LatestBulkCreate(BaseModel):
+    time_stamp: float
+    data: list[LatestBase]
+
+
 class AverageBase(BaseModel):
     item_id: int
     low_price: int
@@ -62,6 +85,21 @@ class Average(AverageBase):
         orm_mode = True
 
 
+class AverageBulkCreate(BaseModel):
+    time_stamp: float
+    data: list[AverageBase]
+
+
+class PriceRow(NamedTuple):
+    # A committed latest or average price as the in-process consumers take it, latest rows have no volumes
+    item_id: int
+    time_stamp: datetime
+    low_price: int
+    high_price: int
+    low_volume: int | None = None
+    high_volume: int | None = None
+
+
 class DailyBase(BaseModel):
     item_id: int
     price: int
@@ -82,6 +120,82 @@ class Daily(DailyBase):
         orm_mode = True
 
 
+class DailyAggregate(BaseModel):
+    rows: int
+    chunks: int
+    seconds: float
+
+
+class Candle(BaseModel):
+    id: int
+    item_id: int
+    interval: str
+    time_stamp: datetime
+    low_open: int
+    low_high: int
+    low_low: int
+    low_close: int
+    high_open: int
+    high_high: int
+    high_low: int
+    high_close: int
+    ticks: int
+
+    class Config:
+        orm_mode = True
+
+
+class IndicatorWindow(BaseModel):
+    window: int
+    bars: int
+    sma: float | None
+    ema: float | None
+    volatility: float | None
+    vwap: float | None
+
+
+class Indicators(BaseModel):
+    item_id: int
+    time_stamp: datetime
+    price: float | None
+    windows: list[IndicatorWindow]
+
+
+class Flip(BaseModel):
+    item_id: int
+    name: str
+    low_price: int
+    high_price: int
+    tax: int
+    margin: int
+    roi: float
+    volume: int
+    limit: int
+    profit: int
+    liquidity: float
+
+
+class MaterialCost(BaseModel):
+    name: str
+    quantity: int
+    unit_cost: float
+    source: str
+
+
+class RecipeProfit(BaseModel):
+    production_id: int
+    item_id: int
+    name: str | None
+    quantity: int
+    ticks: int
+    revenue: float
+    cost: float
+    profit: float
+    profit_per_tick: float
+    profit_per_hour: float
+    materials: list[MaterialCost] = []
+
+
 class MaterialBase(BaseModel):
     production_id: int
     name: str
@@ -171,6 +285,26 @@ class Item(ItemBase):
         orm_mode = True
 
 
+class ItemFilter(BaseModel):
+    category: str | None = None
+    members: bool | None = None
+    min_price: int | None = None
+    max_price: int | None = None
+    min_limit: int | None = None
+    max_limit: int | None = None
+    min_high_alch: int | None = None
+    max_high_alch: int | None = None
+    min_volume: int | None = None
+
+
+class ItemMatch(BaseModel):
+    id: int
+    name: str
+    members: bool
+    categories: list[str] = []
+    score: float
+
+
 class ItemFull(Item):
     categories: list[Category] = []
     latest: list[Latest] = []
@@ -178,3 +312,36 @@ class ItemFull(Item):
     daily: list[Daily] = []
     production: list[Production] = []
     materials: list[Material] = []
+
+
+class AlertRuleBase(BaseModel):
+    item_id: int
+    source: Literal['latest', 'average'] = 'latest'
+    field: Literal['low_price', 'high_price']
+    op: Literal['<', '<=', '>', '>=']
+    threshold: int
+
+
+class AlertRuleCreate(AlertRuleBase):
+    pass
+
+
+class AlertRule(AlertRuleBase):
+    id: int
+    created: datetime
+    updated: datetime
+
+    class Config:
+        orm_mode = True
+
+
+class AlertTrigger(BaseModel):
+    id: int
+    rule_id: int
+    item_id: int
+    price: int
+    time_stamp: datetime
+    created: datetime
+
+    class Config:
+        orm_mode = True
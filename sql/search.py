@@ -0,0 +1,165 @@
+import asyncio
+import os
+import re
+import time
+from collections import Counter
+
+from sqlalchemy import select
+
+from . import models
+from .database import async_session
+
+# Seconds between full rebuilds, picks up items and categories written outside this process
+ITEM_INDEX_TTL = float(os.environ.get('ITEM_INDEX_TTL', 300))
+
+# Lowest trigram similarity of a fuzzy match, the pg_trgm default
+FUZZY_THRESHOLD = 0.3
+
+# Ranking tiers, lower is better
+EXACT, PREFIX, WORD_PREFIX, FUZZY = range(4)
+
+_SEPARATORS = re.compile(r'[^0-9a-z]+')
+
+
+def normalize(text: str) -> str:
+    return _SEPARATORS.sub(' ', text.lower()).strip()
+
+
+def trigrams(text: str) -> set[str]:
+    # Padded like pg_trgm so short words and word starts still produce trigrams
+    padded = f'  {text} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class Node:
+    __slots__ = ('children', 'ids')
+
+    def __init__(self):
+        self.children: dict[str, Node] = {}
+        self.ids: set[int] = set()
+
+
+class ItemIndex:
+    """Item names held in a word prefix trie and trigram posting lists, searches never touch the database."""
+
+    def __init__(self, max_age: float = ITEM_INDEX_TTL):
+        self.max_age = max_age
+        self.loaded = 0.0
+        self.items: dict[int, dict] = {}
+        self.root = Node()
+        self.postings: dict[str, set[int]] = {}
+        self._lock = asyncio.Lock()
+
+    async def refresh(self) -> None:
+        async with self._lock:
+            if time.monotonic() - self.loaded <= self.max_age:
+                return
+
+            async with async_session() as session:
+                items = (await session.execute(select(models.Items.id, models.Items.name, models.Items.members))).all()
+                categories = (await session.execute(select(models.Category.item_id, models.Category.name))).all()
+
+            self.items, self.root, self.postings = {}, Node(), {}
+            for item_id, name, members in items:
+                self._add(item_id, name, members)
+            for item_id, name in categories:
+                if item_id in self.items:
+                    self.items[item_id]['categories'].add(name)
+            self.loaded = time.monotonic()
+
+    def _add(self, item_id: int, name: str, members: bool, categories: set[str] = frozenset()) -> None:
+        normalized = normalize(name)
+        self.items[item_id] = {'id': item_id, 'name': name, 'members': bool(members), 'normalized': normalized,
+                               'trigrams': trigrams(normalized), 'categories': set(categories)}
+
+        # Every word is inserted, so "pl" finds "Rune platebody"
+        for word in set(normalized.split()):
+            node = self.root
+            for char in word:
+                node = node.children.setdefault(char, Node())
+                node.ids.add(item_id)
+        for trigram in self.items[item_id]['trigrams']:
+            self.postings.setdefault(trigram, set()).add(item_id)
+
+    def _remove(self, item_id: int) -> None:
+        item = self.items.pop(item_id, None)
+        if item is None:
+            return
+
+        for word in set(item['normalized'].split()):
+            node = self.root
+            for char in word:
+                node = node.children[char]
+                node.ids.discard(item_id)
+        for trigram in item['trigrams']:
+            self.postings[trigram].discard(item_id)
+
+    def put(self, item: models.Items) -> None:
+        # Called after create and update, keeps the categories already known for the item
+        current = self.items.get(item.id)
+        categories = current['categories'] if current is not None else set()
+        self._remove(item.id)
+        self._add(item.id, item.name, item.members, categories)
+
+    def _prefixed(self, word: str) -> set[int]:
+        node = self.root
+        for char in word:
+            node = node.children.get(char)
+            if node is None:
+                return set()
+        return node.ids
+
+    def _rank(self, item: dict, query: str, words: list[str], query_trigrams: set[str],
+              shared: int) -> tuple[int, float] | None:
+        normalized = item['normalized']
+        similarity = shared / (len(query_trigrams) + len(item['trigrams']) - shared) if shared else 0.0
+        if normalized == query:
+            return EXACT, 1.0
+        if normalized.startswith(query):
+            return PREFIX, similarity
+        if words and all(any(name_word.startswith(word) for name_word in normalized.split()) for word in words):
+            return WORD_PREFIX, similarity
+        if similarity >= FUZZY_THRESHOLD:
+            return FUZZY, similarity
+        return None
+
+    async def search(self, query: str, limit: int = 20, category: str | None = None,
+                     members: bool | None = None) -> list[dict]:
+        if time.monotonic() - self.loaded > self.max_age:
+            await self.refresh()
+
+        query = normalize(query)
+        if not query:
+            return []
+        words = query.split()
+        query_trigrams = trigrams(query)
+
+        # Every query word must prefix some word of the name, typos fall through to the trigram candidates
+        candidates = set.intersection(*(self._prefixed(word) for word in words)) if words else set()
+        shared = Counter()
+        for trigram in query_trigrams:
+            shared.update(self.postings.get(trigram, ()))
+
+        category = category.lower() if category is not None else None
+        matches = []
+        for item_id in candidates | shared.keys():
+            item = self.items[item_id]
+            # Outside the prefix candidates only a fuzzy match is possible, skip items too dissimilar to reach it
+            if item_id not in candidates and shared[item_id] * (1 + FUZZY_THRESHOLD) < FUZZY_THRESHOLD * (
+                    len(query_trigrams) + len(item['trigrams'])):
+                continue
+            if members is not None and item['members'] != members:
+                continue
+            if category is not None and all(name.lower() != category for name in item['categories']):
+                continue
+            rank = self._rank(item, query, words, query_trigrams, shared[item_id])
+            if rank is not None:
+                matches.append((rank[0], -rank[1], len(item['name']), item['name'], item_id, rank[1]))
+
+        matches.sort()
+        return [{'id': item_id, 'name': name, 'members': self.items[item_id]['members'],
+                 'categories': sorted(self.items[item_id]['categories']), 'score': round(score, 4)}
+                for _, _, _, name, item_id, score in matches[:limit]]
+
+
+item_index = ItemIndex()
@@ -0,0 +1,119 @@
+import asyncio
+import json
+import os
+from datetime import date, datetime
+
+from . import schemas
+
+# Events buffered per subscriber, a client that falls this far behind is disconnected rather than slowing the ingest
+STREAM_QUEUE_SIZE = int(os.environ.get('STREAM_QUEUE_SIZE', 1000))
+
+# Seconds between keep-alive comments on an idle stream, also how soon a closed connection is noticed
+STREAM_HEARTBEAT = float(os.environ.get('STREAM_HEARTBEAT', 15))
+
+# Item ids one subscription may name
+STREAM_MAX_ITEMS = int(os.environ.get('STREAM_MAX_ITEMS', 1000))
+
+SOURCES = {'latest': ('item_id', 'low_price', 'high_price', 'time_stamp'),
+           'average': ('item_id', 'low_price', 'high_price', 'low_volume', 'high_volume', 'time_stamp')}
+
+_DROPPED = 'event: dropped\ndata: {"reason": "slow consumer"}\n\n'
+
+
+def _isoformat(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    raise TypeError(f'Cannot serialize {type(value).__name__}')
+
+
+class Subscriber:
+    __slots__ = ('items', 'sources', 'queue', 'dropped')
+
+    def __init__(self, items: set[int], sources: set[str], queue_size: int):
+        self.items = items
+        self.sources = sources
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.dropped = False
+
+
+class Broker:
+    """Fans ingested rows out to the subscribers of their item, each encoded once however many clients listen."""
+
+    def __init__(self, queue_size: int = STREAM_QUEUE_SIZE, heartbeat: float = STREAM_HEARTBEAT):
+        self.queue_size = queue_size
+        self.heartbeat = heartbeat
+        self.subscribers: dict[int, set[Subscriber]] = {}
+        self.connections = 0
+        self.published = 0
+        self.delivered = 0
+        self.dropped = 0
+
+    def subscribe(self, items: set[int], sources: set[str]) -> Subscriber:
+        subscriber = Subscriber(items, sources, self.queue_size)
+        for item_id in items:
+            self.subscribers.setdefault(item_id, set()).add(subscriber)
+        self.connections += 1
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber) -> None:
+        for item_id in subscriber.items:
+            subscribers = self.subscribers.get(item_id)
+            if subscribers is not None and subscriber in subscribers:
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del self.subscribers[item_id]
+        if subscriber.items:
+            self.connections -= 1
+            subscriber.items = set()
+
+    def _drop(self, subscriber: Subscriber) -> None:
+        # The backlog is discarded to make room for the notice, the client resyncs from /latest/ on reconnect
+        self.unsubscribe(subscriber)
+        subscriber.dropped = True
+        self.dropped += 1
+        while not subscriber.queue.empty():
+            subscriber.queue.get_nowait()
+        subscriber.queue.put_nowait(_DROPPED)
+
+    def publish(self, source: str, rows: list[schemas.PriceRow]) -> None:
+        # Never awaits, so events keep ingest order
+        fields = SOURCES[source]
+        for row in rows:
+            subscribers = self.subscribers.get(row.item_id)
+            if not subscribers:
+                continue
+
+            data = {field: getattr(row, field) for field in fields}
+            message = f'event: {source}\ndata: {json.dumps(data, default=_isoformat)}\n\n'
+            self.published += 1
+            for subscriber in list(subscribers):
+                if source not in subscriber.sources:
+                    continue
+                try:
+                    subscriber.queue.put_nowait(message)
+                    self.delivered += 1
+                except asyncio.QueueFull:
+                    self._drop(subscriber)
+
+    async def events(self, subscriber: Subscriber):
+        # Body of the event stream response, unsubscribes when the client goes away or is dropped
+        try:
+            yield ': subscribed\n\n'
+            while True:
+                try:
+                    message = await asyncio.wait_for(subscriber.queue.get(), self.heartbeat)
+                except asyncio.TimeoutError:
+                    yield ': keep-alive\n\n'
+                    continue
+                yield message
+                if message is _DROPPED:
+                    return
+        finally:
+            self.unsubscribe(subscriber)
+
+    def stats(self) -> dict:
+        return {'connections': self.connections, 'items': len(self.subscribers), 'published': self.published,
+                'delivered': self.delivered, 'dropped': self.dropped}
+
+
+broker = Broker()
@@ -0,0 +1,96 @@
+import asyncio
+import os
+import time
+from datetime import datetime, timezone
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from . import crud
+from .database import async_session
+
+# Seconds the shared write sequences are trusted before they are read again. A commit of this process forces the next
+# read, writes made by other workers and jobs show up at most this late
+DATA_VERSION_TTL = float(os.environ.get('DATA_VERSION_TTL', 1))
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+class DataVersions:
+    """Per-table write sequence numbers kept in the database, used as HTTP validators for read endpoints."""
+
+    def __init__(self, max_age: float = DATA_VERSION_TTL):
+        self.max_age = max_age
+        self.loaded = 0.0
+        self.sequence: dict[str, int] = {}
+        self.modified: dict[str, datetime] = {}
+        # Commits of this process per table since the sequences were last read, they are not changes made elsewhere
+        self.own: dict[str, int] = {}
+        self.read = False
+        # Called with the name of each table another process has written since the last read
+        self.on_change: list = []
+        self._lock = asyncio.Lock()
+
+    def _apply(self, rows) -> set[str]:
+        # Sequences only move forward, any that moved further than this process's own commits changed elsewhere
+        changed = set()
+        for name, sequence, modified in rows:
+            current = self.sequence.get(name, 0)
+            own = self.own.pop(name, 0)
+            if sequence > current:
+                if self.read and sequence > current + own:
+                    changed.add(name)
+                self.sequence[name] = sequence
+                self.modified[name] = modified.replace(tzinfo=timezone.utc)
+        self.read = True
+        return changed
+
+    async def refresh(self) -> None:
+        if time.monotonic() - self.loaded <= self.max_age:
+            return
+
+        async with self._lock:
+            # Every request that saw the TTL expire waits here, the first reads the sequences and runs the change hooks,
+            # the rest validate against what it read rather than each issuing its own query
+            if time.monotonic() - self.loaded <= self.max_age:
+                return
+            async with async_session() as session:
+                rows = await crud.get_data_versions(session)
+            changed = self._apply(rows)
+            self.loaded = time.monotonic()
+        self._notify(changed)
+
+    def committed(self, tables: set[str]) -> None:
+        for table in tables:
+            self.own[table] = self.own.get(table, 0) + 1
+        self.loaded = 0.0
+
+    def _notify(self, changed: set[str]) -> None:
+        for table in changed:
+            for hook in self.on_change:
+                hook(table)
+
+    def etag(self, *tables: str) -> str:
+        sequence = '.'.join(str(self.sequence.get(table, 0)) for table in tables)
+        return f'W/"{sequence}"'
+
+    def last_modified(self, *tables: str) -> datetime:
+        # HTTP dates have whole second precision
+        return max([EPOCH, *(self.modified[table] for table in tables if table in self.modified)]).replace(
+            microsecond=0)
+
+
+data_versions = DataVersions()
+
+
+# crud.bump_data_version marks the session, the sequences it advanced are only known to have moved once it commits
+@event.listens_for(Session, 'after_commit')
+def _after_commit(session) -> None:
+    tables = session.info.pop('versions', None)
+    if tables:
+        data_versions.committed(tables)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _after_rollback(session) -> None:
+    session.info.pop('versions', None)
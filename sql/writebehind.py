@@ -0,0 +1,175 @@
+import asyncio
+import logging
+import os
+import time
+
+from sqlalchemy import select
+from sqlalchemy.exc import DataError, IntegrityError
+
+from . import crud, metrics, models
+from .database import async_session
+
+logger = logging.getLogger(__name__)
+
+# Off by default. 'flush' acknowledges a create once its batch is committed, 'enqueue' as soon as it is queued, which
+# is faster but loses queued rows if the process dies before the next flush
+WRITE_BEHIND = os.environ.get('WRITE_BEHIND', '').lower()
+WRITE_BEHIND_MODES = ('flush', 'enqueue')
+
+# A batch is committed when its oldest row has waited this long or this many rows are queued, whichever comes first
+WRITE_BEHIND_INTERVAL = float(os.environ.get('WRITE_BEHIND_INTERVAL_MS', 50)) / 1000
+WRITE_BEHIND_MAX_ROWS = int(os.environ.get('WRITE_BEHIND_MAX_ROWS', 1000))
+
+# Producers wait for room once this many rows are queued
+WRITE_BEHIND_QUEUE_SIZE = int(os.environ.get('WRITE_BEHIND_QUEUE_SIZE', 100_000))
+
+_STOP = object()
+
+
+class WriteBehind:
+    """Coalesces single-row creates into bulk upserts committed by one background flusher."""
+
+    def __init__(self, model, keys: tuple[str, ...] = ('item_id', 'time_stamp'), mode: str = WRITE_BEHIND,
+                 interval: float = WRITE_BEHIND_INTERVAL, max_rows: int = WRITE_BEHIND_MAX_ROWS,
+                 queue_size: int = WRITE_BEHIND_QUEUE_SIZE):
+        self.model = model
+        self.keys = keys
+        self.mode = mode
+        self.interval = interval
+        self.max_rows = max_rows
+        self.queue_size = queue_size
+        # Called with the committed rows of every batch, in flush order, coroutines are awaited
+        self.on_flush: list = []
+
+        self.received = 0
+        self.written = 0
+        self.batches = 0
+        self.failed = 0
+        self.max_batch = 0
+        self.flush_seconds = 0.0
+        self.wait_seconds = 0.0
+
+        self._queue: asyncio.Queue | None = None
+        self._full: asyncio.Event | None = None
+        self._task: asyncio.Task | None = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode in WRITE_BEHIND_MODES
+
+    def start(self) -> None:
+        if self._task is None:
+            self._queue = asyncio.Queue(maxsize=self.queue_size)
+            self._full = asyncio.Event()
+            self._task = metrics.background_task(self._run())
+
+    async def stop(self) -> None:
+        # Rows already queued are flushed before the flusher exits
+        if self._task is not None:
+            await self._queue.put(_STOP)
+            self._full.set()
+            await self._task
+            self._task = None
+
+    async def put(self, row: dict):
+        self.start()
+        future = asyncio.get_running_loop().create_future() if self.mode == 'flush' else None
+        await self._queue.put((row, future, time.perf_counter()))
+        self.received += 1
+        if self._queue.qsize() >= self.max_rows:
+            self._full.set()
+        return await future if future is not None else None
+
+    def _take(self, batch: list) -> bool:
+        # Moves queued rows into the batch, True once the stop marker is seen
+        while len(batch) < self.max_rows and not self._queue.empty():
+            entry = self._queue.get_nowait()
+            if entry is _STOP:
+                return True
+            batch.append(entry)
+        return False
+
+    async def _run(self) -> None:
+        stopping = False
+        while not stopping:
+            entry = await self._queue.get()
+            if entry is _STOP:
+                break
+            batch = [entry]
+
+            try:
+                await asyncio.wait_for(self._full.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._full.clear()
+            stopping = self._take(batch)
+            await self._flush(batch)
+
+    async def _write(self, batch: list) -> tuple[dict, list]:
+        # Committed rows by key and the entries that could not be written. A batch rejected for its data is split in
+        # halves until the offending rows are isolated, anything else (the database being down) fails it whole
+        rows = [row for row, _, _ in batch]
+        try:
+            async with async_session() as session:
+                await crud.bulk_upsert(session, self.model, rows, self.keys)
+                return await self._committed(session, rows), []
+        except (IntegrityError, DataError) as e:
+            if len(batch) == 1:
+                return {}, [(batch[0], e)]
+            middle = len(batch) // 2
+            committed, rejected = await self._write(batch[:middle])
+            later_committed, later_rejected = await self._write(batch[middle:])
+            return {**committed, **later_committed}, rejected + later_rejected
+        except Exception as e:
+            return {}, [(entry, e) for entry in batch]
+
+    async def _flush(self, batch: list) -> None:
+        started = time.perf_counter()
+        committed, rejected = await self._write(batch)
+
+        if rejected:
+            self.failed += len(rejected)
+            logger.error('Write-behind flush rejected %d of %d %s rows', len(rejected), len(batch),
+                         self.model.__tablename__, exc_info=rejected[0][1])
+            for (_, future, _), e in rejected:
+                if future is not None and not future.done():
+                    future.set_exception(e)
+            if not committed:
+                return
+
+        finished = time.perf_counter()
+        self.written += len(committed)
+        self.batches += 1
+        self.max_batch = max(self.max_batch, len(batch))
+        self.flush_seconds += finished - started
+        self.wait_seconds += sum(finished - queued for _, _, queued in batch)
+
+        for hook in self.on_flush:
+            try:
+                result = hook(list(committed.values()))
+                if asyncio.iscoroutine(result):
+                    await result
+            except Exception:
+                logger.exception('Write-behind flush hook failed')
+
+        for row, future, _ in batch:
+            if future is not None and not future.done():
+                future.set_result(committed.get(tuple(row[key] for key in self.keys)))
+
+    async def _committed(self, session, rows: list[dict]) -> dict:
+        # Read the batch back to hand out ids, a superset is selected through the key indexes and narrowed here
+        wanted = {tuple(row[key] for key in self.keys) for row in rows}
+        stmt = select(self.model).where(*(getattr(self.model, key).in_({key_values[index] for key_values in wanted})
+                                          for index, key in enumerate(self.keys)))
+        result = await session.execute(stmt)
+        return {key_values: row for row in result.scalars()
+                if (key_values := tuple(getattr(row, key) for key in self.keys)) in wanted}
+
+    def stats(self) -> dict:
+        return {'mode': self.mode or 'off', 'queued': self._queue.qsize() if self._queue is not None else 0,
+                'received': self.received, 'written': self.written, 'batches': self.batches, 'failed': self.failed,
+                'max_batch': self.max_batch, 'flush_seconds': self.flush_seconds, 'wait_seconds': self.wait_seconds}
+
+
+latest_writer = WriteBehind(models.Latest)
+average_writer = WriteBehind(models.Average)
@@ -3,12 +3,19 @@ import datetime
 import pytest
 import pytest_asyncio
 import asyncio
+import json
 import sys
+import time
 
+import httpx
+import numpy as np
 from sqlalchemy.exc import IntegrityError
 
+from main import app
+from sql.cache import PriceCache
 from sql.database import async_session
-from sql import models, schemas, crud
+from sql import (models, schemas, crud, alerts, columnar, daily, export, flips, indicators, metrics, recipes, retention,
+                 rollup, search, stream, versions, writebehind)
 
 
 @pytest_asyncio.fixture(scope="session")
@@ -32,6 +39,12 @@ async def db_session():
     yield db
 
 
+@pytest_asyncio.fixture(scope='module')
+async def client():
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url='http://test') as http:
+        yield http
+
+
 @pytest.mark.asyncio
 class TestDB:
     async def test_create_item(self, db_session):
@@ -114,6 +127,19 @@ class TestDB:
         assert isinstance(result[0], models.Category), "result does not contain Category type"
         assert result[0].name == 'PyTest', 'Incorrect category name'
 
+    async def test_item_search(self, db_session):
+        index = search.ItemIndex()
+        await index.refresh()
+
+        prefix = await index.search('test can')
+        fuzzy = await index.search('canonbal')
+        filtered = await index.search('test', category='pytest')
+
+        assert [item['id'] for item in prefix] == [1], 'Word prefixes did not match'
+        assert fuzzy[0]['id'] == 1, 'Misspelled name was not matched'
+        assert [item['id'] for item in filtered] == [1], 'Category filter was not applied'
+        assert await index.search('test', members=False) == [], 'Members filter was not applied'
+
     async def test_create_average(self, db_session):
         db_add = schemas.AverageCreate(item_id=1, low_price=1, high_price=10, low_volume=10, high_volume=25,
                                        time_stamp=datetime.datetime.utcnow().timestamp())
@@ -218,6 +244,468 @@ class TestDB:
         assert result[0].item_id == 1, 'Result has the incorrect item ID'
         assert result[0].low_price == 1, 'Result does not have correct price'
 
+    async def test_create_latest_bulk(self, db_session):
+        time_stamp = (datetime.datetime.utcnow() - datetime.timedelta(days=1)).timestamp()
+        bulk = schemas.LatestBulkCreate(time_stamp=time_stamp, data=[
+            schemas.LatestBase(item_id=0, low_price=2, high_price=20),
+            schemas.LatestBase(item_id=1, low_price=3, high_price=30),
+            schemas.LatestBase(item_id=1, low_price=4, high_price=40),
+        ])
+        db = db_session
+        async with db as session:
+            result = await crud.create_latest_bulk(session, bulk)
+            repeat = await crud.create_latest_bulk(session, bulk)
+
+        assert isinstance(result, schemas.BulkResult), "result is not a BulkResult type"
+        assert result.received == 2, 'Duplicate items in the snapshot were not collapsed'
+        assert result.inserted == 2 and result.updated == 0, 'Incorrect counts on first ingest'
+        assert repeat.inserted == 0 and repeat.updated == 2, 'Incorrect counts on repeated ingest'
+
+    async def test_create_average_bulk(self, db_session):
+        time_stamp = (datetime.datetime.utcnow() - datetime.timedelta(days=1)).timestamp()
+        bulk = schemas.AverageBulkCreate(time_stamp=time_stamp, data=[
+            schemas.AverageBase(item_id=0, low_price=2, high_price=20, low_volume=5, high_volume=6),
+            schemas.AverageBase(item_id=1, low_price=3, high_price=30, low_volume=7, high_volume=8),
+        ])
+        db = db_session
+        async with db as session:
+            result = await crud.create_average_bulk(session, bulk)
+            retry = await crud.create_average_bulk(session, bulk, on_conflict='ignore')
+
+        assert result.inserted == 2 and result.skipped == 0, 'Incorrect counts on first ingest'
+        assert retry.inserted == 0 and retry.skipped == 2, 'Duplicates were not skipped on retry'
+
+    async def test_get_latest_all_newest(self, db_session):
+        db = db_session
+        async with db as session:
+            result = await crud.get_latest_all(session)
+
+        assert [row.item_id for row in result] == [1, 0], 'Result does not contain one row per item'
+        assert result[0].low_price == 1, 'Result is not the most recent row for the item'
+
+    async def test_get_filtered(self, db_session):
+        db = db_session
+        async with db as session:
+            category = await crud.get_items(session, filters=schemas.ItemFilter(category='PyTest'))
+            priced = await crud.get_items(session, filters=schemas.ItemFilter(min_price=2, min_limit=5000))
+            latest = await crud.get_latest_all(session, filters=schemas.ItemFilter(max_price=1, category='PyTest'))
+            members = await crud.get_items(session, filters=schemas.ItemFilter(members=False))
+
+        assert [item.id for item in category] == [1], 'Category filter was not applied'
+        assert priced == [], 'Price filter matched an older price'
+        assert [row.item_id for row in latest] == [1], 'Filters were not applied to the newest rows'
+        assert members == [], 'Members filter was not applied'
+
+    async def test_get_rows(self, db_session):
+        db = db_session
+        async with db as session:
+            cases = [(schemas.Item, crud.ITEM_FIELDS, await crud.get_items(session),
+                      await crud.get_items_rows(session)),
+                     (schemas.Latest, crud.LATEST_FIELDS, await crud.get_latest_all(session),
+                      await crud.get_latest_all_rows(session)),
+                     (schemas.Average, crud.AVERAGE_FIELDS, await crud.get_average_all(session),
+                      await crud.get_average_all_rows(session))]
+
+        for schema, fields, orm_rows, rows in cases:
+            assert len(rows) > 0, f'No {schema.__name__} rows returned'
+            assert [dict(zip(fields, row)) for row in rows] == [schema.from_orm(row).dict() for row in orm_rows], \
+                f'Plain {schema.__name__} rows do not match the ORM read'
+
+    async def test_get_many(self, db_session):
+        db = db_session
+        async with db as session:
+            items = await crud.get_items_rows(session, limit=None, ids=[0, 1, 99])
+            filtered = await crud.get_items(session, filters=schemas.ItemFilter(category='PyTest'), ids=[0, 1])
+            average = await crud.get_average_current_rows(session, ids=[1, 99])
+            newest = await crud.get_average_all_rows(session)
+
+        assert [row[0] for row in items] == [0, 1], 'Requested items were not returned'
+        assert [item.id for item in filtered] == [1], 'Filters were not applied to the requested items'
+        assert average == [row for row in newest if row[crud.AVERAGE_FIELDS.index('item_id')] == 1], \
+            'Newest average row was not returned'
+
+    async def test_route_rows(self, client):
+        before = metrics.routes.get('GET /items/', metrics.RouteStats()).rows
+        response = await client.get('/items/')
+
+        assert response.status_code == 200, 'Items were not listed'
+        assert metrics.routes['GET /items/'].rows - before == len(response.json()), \
+            'Plain rows were not counted as loaded'
+
+    async def test_items_full(self, client):
+        body = (await client.get('/items/full/1/?include=latest')).json()
+        listed = (await client.get('/items/full/?limit=1')).json()
+        item = schemas.ItemFull.parse_obj(body)
+
+        assert set(body) == set(schemas.Item.__fields__) | {'latest'}, 'Unrequested relations were not left out'
+        assert json.loads(item.json(exclude_unset=True)) == body, 'The body does not match the response model'
+        assert set(listed[0]) == set(schemas.ItemFull.__fields__), 'Relations were missing from the listing'
+
+    async def test_metrics(self, client):
+        route = 'GET /items/{item_id}/'
+        before = metrics.routes.get(route, metrics.RouteStats()).count
+        await client.get('/items/1/')
+        await client.get('/items/0/')
+        exposition = (await client.get('/metrics')).text
+        lines = exposition.splitlines()
+
+        assert metrics.routes[route].count - before == 2, 'Requests were not labelled by route template'
+        assert f'flipper_http_request_duration_seconds_count{{route="{route}"}} {before + 2}' in lines
+        assert f'flipper_http_request_duration_seconds_bucket{{route="{route}",le="+Inf"}} {before + 2}' in lines
+        assert '# TYPE flipper_http_request_duration_seconds histogram' in lines, 'Histogram type was not declared'
+        samples = [line.rsplit(' ', 1) for line in lines if not line.startswith('#')]
+        assert all(float(value) >= 0 for _, value in samples), 'Malformed sample line'
+        assert any(line.startswith(f'flipper_sql_statements_total{{route="{route}"}} ') for line in lines)
+
+    async def test_not_modified(self, db_session, client):
+        async def create(item_id):
+            await client.post('/items/', json={'id': item_id, 'name': f'Test Etag {item_id}', 'market': 1, 'limit': 1,
+                                               'members': False, 'high_alch': 1, 'low_alch': 1})
+
+        await create(3)
+        first = await client.get('/items/')
+        etag, last_modified = first.headers['etag'], first.headers['last-modified']
+        cached = await client.get('/items/', headers={'If-None-Match': etag})
+        since = await client.get('/items/', headers={'If-Modified-Since': last_modified})
+        earlier = await client.get('/items/', headers={'If-Modified-Since': 'Mon, 01 Jan 2001 00:00:00 GMT'})
+
+        await create(4)
+        written = await client.get('/items/', headers={'If-None-Match': etag})
+        # A second worker sees the write through the shared sequences
+        worker = versions.DataVersions(max_age=0)
+        await worker.refresh()
+        async with db_session as session:
+            await crud.delete_item(session, item_id=3)
+            await crud.delete_item(session, item_id=4)
+
+        assert cached.status_code == 304 and cached.content == b'', 'Matching ETag was not answered with 304'
+        assert since.status_code == 304 and earlier.status_code == 200, 'If-Modified-Since was not applied'
+        assert written.status_code == 200 and written.headers['etag'] != etag, 'Write did not change the ETag'
+        assert worker.etag('items') == written.headers['etag'], 'Validators differ between workers'
+
+    async def test_price_cache(self, db_session):
+        cache = PriceCache(max_age=60)
+        await cache.get(1)
+        await cache.get(1)
+
+        def tick(hour, low_price):
+            time_stamp = datetime.datetime(2100, 1, 1, hour)
+            return models.Latest(id=hour, item_id=1, low_price=low_price, high_price=low_price, time_stamp=time_stamp,
+                                 created=time_stamp, updated=time_stamp)
+
+        cache.put(tick(2, 20))
+        cache.put(tick(1, 10))
+        current = await cache.get(1)
+        cache.max_age = 0
+        await cache.get(1)
+
+        assert current.low_price == 20, 'A late tick replaced a newer price'
+        assert (cache.hits, cache.misses, cache.refreshes) == (2, 2, 2), 'Stale cache was not reloaded'
+
+    async def test_get_latest_by_item_page(self, db_session):
+        db = db_session
+        async with db as session:
+            first = await crud.get_latest_by_item(session, item_id=1, limit=1)
+            before = crud.decode_cursor(crud.encode_cursor(first[-1].time_stamp))
+            second = await crud.get_latest_by_item(session, item_id=1, limit=1, before=before)
+
+        assert len(first) == 1 and len(second) == 1, 'Incorrect page sizes'
+        assert first[0].low_price == 1, 'First page does not start at the newest row'
+        assert second[0].time_stamp < first[0].time_stamp, 'Second page does not continue after the cursor'
+
+    async def test_get_item_full_bounded(self, db_session):
+        db = db_session
+        async with db as session:
+            result = await crud.get_item_full(session, item_id=1, include={'latest'}, limits={'latest': 1})
+
+        assert len(result.latest) == 1, 'Relationship was not limited'
+        assert result.latest[0].low_price == 1, 'Relationship does not start at the newest row'
+        assert result.categories == [], 'Relationship that was not included was loaded'
+
+    async def test_columnar_snapshot(self, db_session, tmp_path):
+        db = db_session
+        async with db as session:
+            written = await columnar.write_snapshot(session, str(tmp_path), 'latest')
+            expected = await crud.get_latest_by_item(session, item_id=1)
+
+        reader = columnar.ColumnarReader(str(tmp_path), 'latest')
+        result = reader.read(1)
+        newest = reader.read(1, start=expected[0].time_stamp)
+
+        assert written == 4, 'Snapshot does not contain every row'
+        assert result['low_price'].tolist() == [row.low_price for row in reversed(expected)], 'Incorrect item slice'
+        assert len(newest['time_stamp']) == 1, 'Time range was not applied'
+        assert len(reader.read(42)['low_price']) == 0, 'Unknown item returned rows'
+
+    async def test_rollup_candles(self, db_session):
+        db = db_session
+        async with db as session:
+            written = await rollup.rollup(session)
+            result = await crud.get_candles_by_item(session, item_id=1, interval='5m')
+            mark = await rollup.get_watermark(session, rollup.watermark_name('5m'))
+
+        assert written['5m'] >= 2, 'Closed 5m buckets were not rolled up'
+        assert isinstance(result[0], models.Candle), "result[0] is not a Candle type"
+        assert result[0].low_open == 4 and result[0].ticks == 1, 'Candle does not match the rolled up tick'
+        assert mark <= datetime.datetime.utcnow() - rollup.ROLLUP_DELAY, 'Watermark passed an open bucket'
+
+    async def test_retention_purge(self, db_session):
+        now = datetime.datetime.utcnow() + datetime.timedelta(days=365)
+        db = db_session
+        async with db as session:
+            latest = await retention.purge(session, 'latest', now=now, batch_size=1)
+            average = await retention.purge(session, 'average', now=now)
+            kept = await crud.get_average_by_item(session, item_id=0)
+            again = await retention.purge(session, 'latest', now=now)
+
+        assert latest['deleted'] == 2, 'Ticks covered by candles were not deleted'
+        assert again['deleted'] == 0 and again['items'] == 0, 'Items without expired rows were visited'
+        assert len(kept) == 1, 'Average rows without a Daily rollup were deleted'
+
+    async def test_aggregate_daily(self, db_session):
+        start = datetime.datetime(2021, 1, 1, 23)
+        rows = [{'item_id': 0, 'time_stamp': start + datetime.timedelta(hours=hour), 'low_price': low_price,
+                 'high_price': low_price + 10, 'low_volume': low_volume, 'high_volume': 1}
+                for hour, low_price, low_volume in ((0, 100, 1), (1, 200, 3), (2, 300, 0))]
+
+        db = db_session
+        async with db as session:
+            await crud.bulk_upsert(session, models.Average, rows, ('item_id', 'time_stamp'))
+            first = await daily.backfill(session, datetime.date(2021, 1, 1), datetime.date(2021, 1, 3), chunk_days=1)
+            again = await daily.backfill(session, datetime.date(2021, 1, 1), datetime.date(2021, 1, 3))
+            result = await crud.get_daily_by_item(session, item_id=0, end=datetime.date(2021, 1, 3))
+
+        assert first['chunks'] == 2 and again['chunks'] == 1, 'Range was not split into chunks'
+        assert [(row.date_stamp, row.price, row.volume) for row in result] == [
+            (datetime.date(2021, 1, 2), 224, 5), (datetime.date(2021, 1, 1), 105, 2)], 'Daily rows do not match'
+
+        today = datetime.datetime.utcnow().date()
+        async with db as session:
+            await session.merge(models.Watermark(name=daily.WATERMARK, time_stamp=datetime.datetime.combine(
+                today - datetime.timedelta(days=1), datetime.time())))
+            await session.commit()
+            await daily.aggregate_pending(session, today=today + datetime.timedelta(days=7))
+            mark = await rollup.get_watermark(session, daily.WATERMARK)
+
+        assert mark.date() == today, 'The current day was aggregated before it closed'
+
+    async def test_write_behind(self, db_session):
+        time_stamp = datetime.datetime(2020, 1, 1)
+        writer = writebehind.WriteBehind(models.Latest, mode='flush', interval=0.01)
+        flushed = []
+        writer.on_flush.append(flushed.extend)
+
+        rows = [{'item_id': 1, 'low_price': price, 'high_price': 10, 'time_stamp': time_stamp} for price in (5, 6)]
+        # Started from a request, the flusher must not charge that request for the batches it writes
+        stats = metrics.RouteStats()
+        token = metrics._current.set(stats)
+        statements = metrics.background.statements
+        try:
+            result = await asyncio.gather(*(writer.put(row) for row in rows))
+        finally:
+            metrics._current.reset(token)
+        await writer.stop()
+
+        db = db_session
+        async with db as session:
+            stored = await crud.get_latest_by_item(session, item_id=1, end=time_stamp)
+
+        assert isinstance(result[0], models.Latest), "result[0] is not a Latest type"
+        assert result[0].id == result[1].id, 'Rows with the same key were not coalesced'
+        assert writer.batches == 1 and len(flushed) == 1, 'Rows were not flushed as one batch'
+        assert [row.low_price for row in stored] == [6], 'The last row for a key was not kept'
+        assert stats.statements == 0 and metrics.background.statements > statements, \
+            'The flusher was charged to the request that started it'
+
+    async def test_write_behind_rejected(self, db_session):
+        writer = writebehind.WriteBehind(models.Latest, mode='flush', interval=0.01)
+        flushed = []
+        writer.on_flush.append(flushed.extend)
+
+        rows = [{'item_id': 1, 'low_price': price, 'high_price': 10, 'time_stamp': datetime.datetime(2020, 1, 2, hour)}
+                for hour, price in enumerate((5, 6, None, 7))]
+        result = await asyncio.gather(*(writer.put(row) for row in rows), return_exceptions=True)
+        await writer.stop()
+
+        assert isinstance(result[2], IntegrityError), 'The invalid row did not fail'
+        assert all(isinstance(row, models.Latest) for row in result[:2] + result[3:]), 'Valid rows were not written'
+        assert writer.failed == 1 and writer.written == 3, 'Only the invalid row should be counted as failed'
+        assert sorted(row.low_price for row in flushed) == [5, 6, 7], 'Written rows were not passed to the hooks'
+
+    async def test_alerts(self, db_session):
+        db = db_session
+        rule = schemas.AlertRuleCreate(item_id=1, field='low_price', op='<', threshold=5)
+
+        async with db as session:
+            db_rule = await crud.create_alert_rule(session, rule)
+
+        engine = alerts.AlertEngine()
+        await engine.refresh()
+        fired = []
+        for hour, low_price in ((1, 3), (2, 10), (3, 4), (4, 20), (0, 2)):
+            time_stamp = datetime.datetime(2100, 1, 1, hour)
+            fired += await engine.ingest('latest', [schemas.PriceRow(1, time_stamp, low_price, 30)])
+
+        async with db as session:
+            triggers = await crud.get_alert_triggers(session, rule_id=db_rule.id)
+            deleted = await crud.delete_alert_rule(session, rule_id=db_rule.id)
+            missing = await crud.get_alert_rule(session, rule_id=db_rule.id)
+
+        assert [trigger['price'] for trigger in fired] == [4], 'Rule did not fire once on crossing its threshold'
+        assert [(trigger.rule_id, trigger.price) for trigger in triggers] == [(db_rule.id, 4)], 'Trigger not recorded'
+        assert deleted.id == db_rule.id and missing is None, 'Rule was not deleted'
+
+        # A stale engine keeps ingesting while the rules reload beside it
+        async with db as session:
+            later_rule = await crud.create_alert_rule(session, rule)
+        engine.max_age = 0
+        stats = metrics.RouteStats()
+        token = metrics._current.set(stats)
+        try:
+            await engine.ingest('latest', [schemas.PriceRow(1, datetime.datetime(2100, 1, 2), 20, 30)])
+            reloading = engine._refreshing
+            await reloading
+        finally:
+            metrics._current.reset(token)
+        async with db as session:
+            await crud.delete_alert_rule(session, rule_id=later_rule.id)
+
+        assert reloading is not None and set(engine.rules) == {later_rule.id}, 'Rules were not reloaded beside ingest'
+        assert stats.statements == 0, 'The reload was charged to the request that scheduled it'
+
+    async def test_stream(self, db_session):
+        broker = stream.Broker(queue_size=2)
+        fast = broker.subscribe({1}, {'latest'})
+        slow = broker.subscribe({1, 2}, {'latest', 'average'})
+        events = broker.events(fast)
+        await anext(events)
+
+        received = []
+        for low_price in (5, 6, 7):
+            broker.publish('latest', [schemas.PriceRow(1, datetime.datetime(2020, 1, 1), low_price, 10)])
+            received.append(await anext(events))
+        broker.publish('average', [schemas.PriceRow(1, datetime.datetime(2020, 1, 1), 1, 2, 3, 4)])
+        await events.aclose()
+
+        assert received[0].startswith('event: latest\n') and '"low_price": 5' in received[0], 'Event not delivered'
+        assert slow.dropped and slow.queue.qsize() == 1, 'Slow consumer was not dropped'
+        assert fast.queue.empty(), 'Unsubscribed source was delivered'
+        assert broker.subscribers == {} and broker.connections == 0, 'Subscribers were not removed'
+
+    async def test_indicators(self, db_session):
+        rng = np.random.default_rng(1)
+        stamps = [datetime.datetime(2020, 1, 1) + datetime.timedelta(minutes=5 * i) for i in range(80)]
+        low = rng.integers(90, 110, 80)
+        high = low + rng.integers(0, 10, 80)
+        low[7] = 0
+        low_volume, high_volume = rng.integers(0, 50, 80), rng.integers(0, 50, 80)
+
+        state = indicators.ItemIndicators(1, stamps[:30], low[:30], high[:30], low_volume[:30], high_volume[:30])
+        for row in zip(stamps[30:], *(column[30:].tolist() for column in (low, high, low_volume, high_volume))):
+            state.update(*row)
+        full = indicators.ItemIndicators(1, stamps, low, high, low_volume, high_volume)
+
+        engine = indicators.IndicatorEngine()
+        stored = await engine.get(1)
+        time_stamp = stored['time_stamp'] + datetime.timedelta(minutes=5)
+        engine.ingest([schemas.PriceRow(1, time_stamp, 4, 6, 1, 1)])
+        updated = await engine.get(1)
+
+        for incremental, vectorized in zip(state.snapshot()['windows'], full.snapshot()['windows']):
+            for name in ('sma', 'ema', 'volatility', 'vwap'):
+                assert incremental[name] == pytest.approx(vectorized[name]), f'Incremental {name} drifted'
+        assert updated['time_stamp'] == time_stamp and updated['price'] == 5, 'New bucket was not applied'
+        assert engine.loads == 1 and await engine.get(-1) is None, 'Indicators were reloaded'
+
+        cold = indicators.IndicatorEngine()
+        first, again, other = await asyncio.gather(cold.get(1), cold.get(1), cold.get(0))
+        assert cold.loads == 2 and first == again and other['item_id'] == 0, 'Concurrent loads were not shared per item'
+
+    async def test_flips(self, db_session):
+        prices = PriceCache(max_age=float('inf'))
+        prices.loaded = time.monotonic()
+        # item_id: (low, high, limit, volume, members), 13 has no buy price and 10 and 14 tie on profit
+        rows = {10: (100, 200, 100, 50, True), 11: (1_000_000_000, 1_010_000_000, 1, 2, False),
+                12: (50, 60, 0, 1000, False), 13: (0, 100, 10, 10, False), 14: (100, 200, 50, 500, True)}
+        time_stamp = datetime.datetime(2020, 1, 1)
+        for item_id, (low, high, _, _, _) in rows.items():
+            prices.put(models.Latest(id=item_id, item_id=item_id, low_price=low, high_price=high, time_stamp=time_stamp,
+                                     created=time_stamp, updated=time_stamp))
+
+        scanner = flips.FlipScanner(prices, max_age=float('inf'))
+        scanner.loaded = time.monotonic()
+        scanner.ids = np.array(list(rows))
+        scanner.names = np.array([f'Item {item_id}' for item_id in rows], dtype=object)
+        scanner.limits, scanner.volumes = (np.array([row[index] for row in rows.values()], dtype=float)
+                                           for index in (2, 3))
+        scanner.members = np.array([row[4] for row in rows.values()])
+        scanner._positions = {item_id: position for position, item_id in enumerate(rows)}
+
+        ranked = {row['item_id']: row for row in await scanner.scan()}
+
+        async def scan(**kwargs):
+            return [row['item_id'] for row in await scanner.scan(**kwargs)]
+
+        assert list(ranked) == [11, 12, 10, 14], 'Flips were not ranked by profit'
+        assert (ranked[10]['tax'], ranked[10]['margin'], ranked[10]['roi'], ranked[10]['profit']) == (4, 96, 0.96, 4800)
+        assert ranked[11]['tax'] == flips.GE_TAX_CAP and ranked[11]['margin'] == 5_000_000, 'Tax was not capped'
+        assert ranked[12]['profit'] == 9000, 'Items without a limit were not sized by volume'
+        assert await scan(limit=3) == [11, 12, 10], 'Ties at the cut were not broken by item id'
+        assert await scan(limit=1, sort='roi') == [10] and await scan(sort='roi') == [10, 14, 12, 11]
+        assert await scan(members=True) == [10, 14], 'Members filter was not applied'
+        assert await scan(min_roi=0.5) == [10, 14], 'ROI filter was not applied'
+        assert await scan(min_volume=600) == [12], 'Volume filter was not applied'
+
+    async def test_recipe_costs(self, db_session):
+        names = {20: 'Ore', 21: 'Bar', 22: 'Helm', 30: 'Left', 31: 'Right', 32: 'Pair'}
+        # item_id: (low, high), crafting a Bar from Ore is cheaper than buying one
+        prices = {item_id: schemas.LatestBase(item_id=item_id, low_price=low, high_price=high)
+                  for item_id, (low, high) in {20: (8, 10), 21: (90, 100), 22: (500, 520), 30: (45, 50),
+                                               31: (35, 40), 32: (200, 210)}.items()}
+
+        def recipe(production_id, item_id, cost, **materials):
+            return models.Production(id=production_id, item_id=item_id, ticks=1, facilities='', members='', cost=cost,
+                                     quantity=1, materials=[models.Material(name=name, quantity=quantity)
+                                                            for name, quantity in materials.items()])
+
+        engine = recipes.RecipeEngine(PriceCache())
+        # Left and Right are each crafted from the other, the guard has to fall back to buying
+        engine.recipes = [recipe(1, 21, 5, Ore=2), recipe(2, 22, 0, Bar=3), recipe(3, 30, 20, Right=1),
+                          recipe(4, 31, 20, Left=1), recipe(5, 32, 0, Left=1, Right=1)]
+        for production in engine.recipes:
+            engine.recipes_by_item.setdefault(production.item_id, []).append(production)
+        engine.item_ids = {name: item_id for item_id, name in names.items()}
+        engine.item_names = names
+
+        results = {result['item_id']: result for result in engine._price_recipes(prices)}
+
+        assert results[22]['materials'][0]['unit_cost'] == 25 and results[22]['materials'][0]['source'] == 'craft', \
+            'The intermediate was not crafted'
+        assert results[22]['cost'] == 75 and results[22]['profit'] == 490 - 75, 'Crafted cost was not carried up'
+        assert results[21]['materials'][0]['source'] == 'buy', 'Raw materials can only be bought'
+        assert [(material['unit_cost'], material['source']) for material in results[32]['materials']] == [
+            (50, 'buy'), (40, 'buy')], 'Cyclic recipes were not bought'
+        assert results[30]['cost'] == 60 and results[31]['cost'] == 70, 'Cyclic recipes were not priced'
+
+        # Plank is crafted from Log and Log from Plank or Seed, a Plank costed while Log was on the path must not stick
+        names = {40: 'Log', 41: 'Plank', 42: 'Seed', 43: 'Table'}
+        prices = {item_id: schemas.LatestBase(item_id=item_id, low_price=low, high_price=high)
+                  for item_id, (low, high) in {40: (100, 100), 41: (100, 100), 42: (1, 1), 43: (500, 500)}.items()}
+        engine = recipes.RecipeEngine(PriceCache())
+        engine.recipes = [recipe(6, 41, 0, Log=1), recipe(7, 40, 0, Plank=1), recipe(8, 40, 0, Seed=1),
+                          recipe(9, 43, 0, Plank=1)]
+        for production in engine.recipes:
+            engine.recipes_by_item.setdefault(production.item_id, []).append(production)
+        engine.item_ids = {name: item_id for item_id, name in names.items()}
+        engine.item_names = names
+
+        results = {result['item_id']: result for result in engine._price_recipes(prices)}
+
+        assert (results[41]['materials'][0]['unit_cost'], results[41]['materials'][0]['source']) == (1, 'craft'), \
+            'The cheaper path out of the cycle was not taken'
+        assert (results[43]['materials'][0]['unit_cost'], results[43]['materials'][0]['source']) == (1, 'craft'), \
+            'A cost computed under a cycle cut was memoized'
+
     async def test_add_production(self, db_session):
         db = db_session
         prod = schemas.ProductionCreate(item_id=1, ticks=2, facilities='Furnace', members='T', cost=1, quantity=1)
@@ -331,6 +819,23 @@ class TestDB:
         assert isinstance(result, list), "result is not an Item type"
         assert result[0].id == 0, "Correct ID was not returned in query"
 
+    async def test_export(self, db_session):
+        start = datetime.datetime(1990, 1, 1)
+        rows = [{'item_id': 0, 'low_price': price, 'high_price': price,
+                 'time_stamp': start + datetime.timedelta(hours=hour)} for hour, price in enumerate((11, 12, 13))]
+        async with db_session as session:
+            await crud.bulk_upsert(session, models.Latest, rows, ('item_id', 'time_stamp'))
+
+        window = {'start': start + datetime.timedelta(minutes=30), 'end': start + datetime.timedelta(days=1),
+                  'item_id': 0}
+        ndjson = ''.join([chunk async for chunk in export.stream('latest', 'ndjson', **window)])
+        table = ''.join([chunk async for chunk in export.stream('latest', 'csv', **window)])
+        lines = table.splitlines()
+
+        assert [json.loads(line)['low_price'] for line in ndjson.splitlines()] == [12, 13], 'Time range was not applied'
+        assert lines[0].split(',') == [column.name for column in models.Latest.__table__.columns], 'Header is wrong'
+        assert len(lines) == 3 and lines[1].split(',')[2] == '12', 'CSV rows do not match'
+
     async def test_delete_data(self, db_session):
         db = db_session
 